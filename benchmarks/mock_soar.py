@@ -0,0 +1,387 @@
+# File: mock_soar.py
+#
+# Copyright (c) Mhike, 2022-2025
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+#
+#
+# Local stand-in for the SOAR REST endpoints used by the runner connector, serving synthetic datasets
+
+import bisect
+import json
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+ARTIFACT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+PLAYBOOKS = ["local/follow_up", "local/recheck_indicator", "local/close_stale", "community/notify_owner"]
+
+
+def format_time(value):
+    return value.strftime(ARTIFACT_TIME_FORMAT)
+
+
+def parse_filter_value(value):
+    if value.startswith('"') and value.endswith('"'):
+        return value[1:-1]
+    if value in ("True", "true"):
+        return True
+    if value in ("False", "false"):
+        return False
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def resolve_field(record, path):
+    value = record
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None, False
+        value = value[key]
+    return value, True
+
+
+def matches(record, filters):
+    for path, operator, expected in filters:
+        value, present = resolve_field(record, path)
+        if operator == "isnull":
+            if (value is None) != bool(expected):
+                return False
+            continue
+        if not present or value is None:
+            return False
+        if operator == "exact" and value != expected:
+            return False
+        if operator == "contains" and str(expected) not in str(value):
+            return False
+        if operator == "in" and value not in expected:
+            return False
+        if operator == "gt" and not value > expected:
+            return False
+        if operator == "gte" and not value >= expected:
+            return False
+        if operator == "lt" and not value < expected:
+            return False
+        if operator == "lte" and not value <= expected:
+            return False
+    return True
+
+
+def parse_filters(query):
+    filters = []
+    for key, value in query.items():
+        if not key.startswith("_filter_"):
+            continue
+        parts = key[len("_filter_") :].split("__")
+        operator = "exact"
+        if parts[-1] in ("contains", "in", "gt", "gte", "lt", "lte", "isnull"):
+            operator = parts.pop()
+        filters.append((parts, operator, parse_filter_value(value)))
+    return filters
+
+
+class Dataset:
+    def __init__(self, artifacts=100000, containers=5000, due_fraction=0.01, legacy_fraction=0.01, terminal_fraction=0.0, seed=7):
+        self.lock = threading.Lock()
+        self.settings = {
+            "artifacts": artifacts,
+            "containers": containers,
+            "due_fraction": due_fraction,
+            "legacy_fraction": legacy_fraction,
+            "terminal_fraction": terminal_fraction,
+            "seed": seed,
+        }
+        self.reset()
+
+    def reset(self):
+        settings = self.settings
+        rng = random.Random(settings["seed"])
+        now = datetime.utcnow()
+        self.containers = {}
+        for container_id in range(1, settings["containers"] + 1):
+            self.containers[container_id] = {"id": container_id, "label": "events", "tags": ["waiting"], "status": "new"}
+        self.artifacts = {}
+        self.artifact_ids = []
+        self.source_data_identifiers = {}
+        for artifact_id in range(1, settings["artifacts"] + 1):
+            roll = rng.random()
+            created = now - timedelta(minutes=rng.randint(1, 600))
+            if roll < settings["due_fraction"]:
+                due = now - timedelta(minutes=rng.randint(1, 60))
+            else:
+                due = now + timedelta(minutes=rng.randint(60, 60 * 24 * 30))
+            label = "pending"
+            if rng.random() < settings["terminal_fraction"]:
+                label = rng.choice(["complete", "halted", "invalid playbook"])
+            cef = {
+                "comment": "benchmark schedule",
+                "durationUnit": "Minutes",
+                "duration": max(int((due - created).total_seconds() // 60), 0),
+                "playbook": rng.choice(PLAYBOOKS),
+                "scope": "new",
+            }
+            if rng.random() >= settings["legacy_fraction"]:
+                cef["dueTimestamp"] = int((due - datetime(1970, 1, 1)).total_seconds())
+                cef["dueTime"] = format_time(due)
+            self.artifacts[artifact_id] = {
+                "id": artifact_id,
+                "container": rng.randint(1, settings["containers"]),
+                "name": "scheduled playbook",
+                "label": label,
+                "cef": cef,
+                "create_time": format_time(created),
+                "update_time": format_time(created),
+            }
+            self.artifact_ids.append(artifact_id)
+        self.next_artifact_id = settings["artifacts"] + 1
+        self.scm = [{"id": 1, "name": "local"}, {"id": 2, "name": "community"}]
+        self.playbooks = []
+        for playbook_id, playbook in enumerate(PLAYBOOKS, start=1):
+            repo, name = playbook.split("/")
+            scm_id = 1 if repo == "local" else 2
+            self.playbooks.append(
+                {"id": playbook_id, "name": name, "scm": scm_id, "labels": ["*"], "active": True, "modified_time": format_time(now)}
+            )
+        self.next_run_id = 1
+
+    def create_artifact(self, artifact):
+        with self.lock:
+            # Like the platform, reject a second artifact with the same source data identifier in a container
+            key = (int(artifact["container_id"]), artifact.get("source_data_identifier"))
+            if key[1] and key in self.source_data_identifiers:
+                return {"failed": True, "existing_artifact_id": self.source_data_identifiers[key], "message": "artifact already exists"}
+            artifact_id = self.next_artifact_id
+            self.next_artifact_id += 1
+            now = format_time(datetime.utcnow())
+            record = {
+                "id": artifact_id,
+                "container": int(artifact["container_id"]),
+                "name": artifact.get("name", ""),
+                "label": artifact.get("label", ""),
+                "cef": artifact.get("cef", {}),
+                "create_time": now,
+                "update_time": now,
+            }
+            self.artifacts[artifact_id] = record
+            self.artifact_ids.append(artifact_id)
+            if key[1]:
+                record["source_data_identifier"] = key[1]
+                self.source_data_identifiers[key] = artifact_id
+            return {"success": True, "id": artifact_id}
+
+    def update_artifact(self, artifact_id, update):
+        with self.lock:
+            record = self.artifacts.get(artifact_id)
+            if record is None:
+                return None
+            for key in ("label", "cef", "name"):
+                if key in update:
+                    record[key] = update[key]
+            record["update_time"] = format_time(datetime.utcnow())
+            return {"success": True, "id": artifact_id}
+
+    def delete_artifacts(self, artifact_ids):
+        with self.lock:
+            deleted = []
+            for artifact_id in artifact_ids:
+                record = self.artifacts.pop(artifact_id, None)
+                if record is not None:
+                    deleted.append(artifact_id)
+                    self.source_data_identifiers.pop((record["container"], record.get("source_data_identifier")), None)
+            if deleted:
+                removed = set(deleted)
+                self.artifact_ids = [artifact_id for artifact_id in self.artifact_ids if artifact_id not in removed]
+            return deleted
+
+    def query(self, records, ordered_ids, query):
+        filters = parse_filters(query)
+        page_size = int(query.get("page_size", 10))
+        page = int(query.get("page", 0))
+        start = 0
+        cursor = [value for path, operator, value in filters if path == ["id"] and operator == "gt"]
+        if cursor and ordered_ids is not None:
+            start = bisect.bisect_right(ordered_ids, cursor[0])
+        ids = ordered_ids if ordered_ids is not None else sorted(records)
+        if query.get("order") == "desc":
+            ids = list(reversed(ids))
+            start = 0
+        matched = []
+        # Cursor pages stop scanning once full, so their count only covers the scanned range
+        stop = page_size * (page + 1) if cursor and page_size else None
+        for index in range(start, len(ids)):
+            record = records.get(ids[index])
+            if record is not None and matches(record, filters):
+                matched.append(record)
+                if stop is not None and len(matched) >= stop:
+                    break
+        count = len(matched)
+        if page_size:
+            data = matched[page * page_size : (page + 1) * page_size]
+            num_pages = (count + page_size - 1) // page_size
+        else:
+            data = matched
+            num_pages = 1
+        return {"count": count, "num_pages": num_pages, "data": data}
+
+
+class MockSoarHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    dataset = None
+    latency = 0.0
+    calls = Counter()
+    calls_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        return
+
+    def _send_json(self, code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    def _route(self, method):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = dict(parse_qsl(url.query, keep_blank_values=True))
+        if parts[:1] == ["_bench"]:
+            return self._bench(method, parts[1:])
+        if parts[:1] != ["rest"] or len(parts) < 2:
+            return self._send_json(404, {"failed": True, "message": "Not found"})
+        family = parts[1]
+        with self.calls_lock:
+            self.calls[f"{method} {family}"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        handler = getattr(self, f"_{method.lower()}_{family}", None)
+        if handler is None:
+            return self._send_json(404, {"failed": True, "message": f"Unsupported endpoint {method} {family}"})
+        try:
+            return handler(parts[2:], query)
+        except Exception as e:
+            return self._send_json(500, {"failed": True, "message": str(e)})
+
+    def _bench(self, method, parts):
+        if parts == ["stats"]:
+            with self.calls_lock:
+                return self._send_json(200, dict(self.calls))
+        if parts == ["reset"] and method == "POST":
+            with self.calls_lock:
+                self.calls.clear()
+            settings = self._read_body() or {}
+            self.dataset.settings.update(settings)
+            with self.dataset.lock:
+                self.dataset.reset()
+            return self._send_json(200, {"success": True})
+        return self._send_json(404, {"failed": True})
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    def _get_version(self, parts, query):
+        self._send_json(200, {"version": "6.3.0"})
+
+    def _get_artifact(self, parts, query):
+        dataset = self.dataset
+        if parts:
+            record = dataset.artifacts.get(int(parts[0]))
+            return self._send_json(200 if record else 404, record or {"failed": True})
+        with dataset.lock:
+            response = dataset.query(dataset.artifacts, dataset.artifact_ids, query)
+        self._send_json(200, response)
+
+    def _post_artifact(self, parts, query):
+        dataset = self.dataset
+        body = self._read_body()
+        if parts:
+            response = dataset.update_artifact(int(parts[0]), body)
+            return self._send_json(200 if response else 404, response or {"failed": True})
+        if isinstance(body, list):
+            return self._send_json(200, [dataset.create_artifact(artifact) for artifact in body])
+        self._send_json(200, dataset.create_artifact(body))
+
+    def _delete_artifact(self, parts, query):
+        body = self._read_body() or {}
+        ids = [int(parts[0])] if parts else body.get("ids", [])
+        deleted = self.dataset.delete_artifacts(ids)
+        self._send_json(200, {"success": True, "deleted": len(deleted)})
+
+    def _get_container(self, parts, query):
+        dataset = self.dataset
+        if len(parts) == 2 and parts[1] == "artifacts":
+            query["_filter_container"] = parts[0]
+            with dataset.lock:
+                response = dataset.query(dataset.artifacts, dataset.artifact_ids, query)
+            return self._send_json(200, response)
+        if parts:
+            record = dataset.containers.get(int(parts[0]))
+            return self._send_json(200 if record else 404, record or {"failed": True})
+        with dataset.lock:
+            response = dataset.query(dataset.containers, sorted(dataset.containers), query)
+        self._send_json(200, response)
+
+    def _post_container(self, parts, query):
+        body = self._read_body() or {}
+        with self.dataset.lock:
+            record = self.dataset.containers.get(int(parts[0])) if parts else None
+            if record is None:
+                return self._send_json(404, {"failed": True})
+            record.update({key: value for key, value in body.items() if key in ("tags", "status", "label")})
+        self._send_json(200, {"success": True, "id": record["id"]})
+
+    def _get_scm(self, parts, query):
+        self._send_json(200, self.dataset.query({scm["id"]: scm for scm in self.dataset.scm}, None, query))
+
+    def _get_playbook(self, parts, query):
+        self._send_json(200, self.dataset.query({playbook["id"]: playbook for playbook in self.dataset.playbooks}, None, query))
+
+    def _post_playbook_run(self, parts, query):
+        body = self._read_body() or {}
+        with self.dataset.lock:
+            run_id = self.dataset.next_run_id
+            self.dataset.next_run_id += 1
+        self._send_json(200, {"playbook_run_id": run_id, "message": f"Playbook {body.get('playbook_id')} queued"})
+
+
+def serve(port_queue, settings, latency, port=0):
+    MockSoarHandler.dataset = Dataset(**settings)
+    MockSoarHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockSoarHandler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
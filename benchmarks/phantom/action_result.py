@@ -0,0 +1,49 @@
+# File: action_result.py
+#
+# Copyright (c) Mhike, 2022-2025
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+#
+#
+
+
+class ActionResult:
+    def __init__(self, param=None):
+        self.param = param or {}
+        self.data = []
+        self.summary = {}
+        self.status = True
+        self.message = ""
+
+    def add_data(self, data):
+        self.data.append(data)
+
+    def get_data(self):
+        return self.data
+
+    def update_summary(self, summary):
+        self.summary.update(summary)
+        return self.summary
+
+    def get_summary(self):
+        return self.summary
+
+    def set_status(self, status, message=""):
+        self.status = status
+        self.message = str(message)
+        return status
+
+    def get_status(self):
+        return self.status
+
+    def get_message(self):
+        return self.message
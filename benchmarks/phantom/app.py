@@ -0,0 +1,110 @@
+# File: app.py
+#
+# Copyright (c) Mhike, 2022-2025
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+#
+#
+
+import json
+import tempfile
+
+# Exposed as phantom.requests like the platform module
+import requests  # noqa: F401
+
+
+APP_SUCCESS = True
+APP_ERROR = False
+
+
+class BaseConnector:
+    # Attributes are prefixed so they cannot shadow anything the connector under test sets on itself
+    def __init__(self):
+        self._stub_config = {}
+        self._stub_state = {}
+        self._stub_action_identifier = None
+        self._stub_asset_id = "1"
+        self._stub_container_id = None
+        self._stub_base_url = None
+        self._stub_action_results = []
+        self._stub_status = APP_SUCCESS
+        self._stub_progress = []
+        self._stub_debug_messages = []
+
+    def get_config(self):
+        return self._stub_config
+
+    def get_action_identifier(self):
+        return self._stub_action_identifier
+
+    def get_asset_id(self):
+        return self._stub_asset_id
+
+    def get_container_id(self):
+        return self._stub_container_id
+
+    def get_phantom_base_url(self):
+        return self._stub_base_url
+
+    def get_state_dir(self):
+        return tempfile.gettempdir()
+
+    def load_state(self):
+        return json.loads(json.dumps(self._stub_state))
+
+    def save_state(self, state):
+        self._stub_state = json.loads(json.dumps(state))
+
+    def add_action_result(self, action_result):
+        self._stub_action_results.append(action_result)
+        return action_result
+
+    def get_action_results(self):
+        return self._stub_action_results
+
+    def save_progress(self, message, *args):
+        self._stub_progress.append(message)
+
+    def debug_print(self, message, dump_object=""):
+        self._stub_debug_messages.append(message)
+
+    def error_print(self, message, dump_object=""):
+        self._stub_debug_messages.append(message)
+
+    def set_status(self, status, message=""):
+        self._stub_status = status
+        return status
+
+    def initialize(self):
+        return APP_SUCCESS
+
+    def finalize(self):
+        return APP_SUCCESS
+
+    def _handle_action(self, in_json, handle):
+        in_json = json.loads(in_json)
+        self._stub_config = in_json.get("config", {})
+        self._stub_action_identifier = in_json["identifier"]
+        self._stub_asset_id = in_json.get("asset_id", self._stub_asset_id)
+        self._stub_container_id = in_json.get("container_id", self._stub_container_id)
+        self._stub_base_url = in_json.get("base_url", self._stub_base_url)
+        if not self.initialize():
+            return json.dumps({"status": "failed"})
+        for param in in_json.get("parameters", [{}]):
+            self.handle_action(param)
+        self.finalize()
+        return json.dumps(
+            [
+                {"status": "success" if result.get_status() else "failed", "message": result.get_message(), "summary": result.get_summary()}
+                for result in self._stub_action_results
+            ]
+        )
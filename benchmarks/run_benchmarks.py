@@ -0,0 +1,211 @@
+# File: run_benchmarks.py
+#
+# Copyright (c) Mhike, 2022-2025
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+#
+#
+# Offline benchmarks for the runner connector. Usage:
+#
+#     python benchmarks/run_benchmarks.py --artifacts 100000 --containers 5000 --latency-ms 2
+#
+# A mock SOAR REST server with a synthetic dataset is started in a separate process and every scenario drives
+# RunnerConnector through the stub phantom package in its own process, so peak RSS is measured per scenario.
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import requests
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+SCENARIOS = {
+    "on_poll": {"identifier": "on_poll", "parameters": [{}], "reset": True},
+    "on_poll_warm": {"identifier": "on_poll", "parameters": [{}], "reset": False},
+    "schedule_playbook": {
+        "identifier": "schedule_playbook",
+        "parameters": [
+            {
+                "delay_purpose": "benchmark",
+                "duration_unit": "Minutes",
+                "delay_duration": 5,
+                "playbook": "local/follow_up",
+                "playbook_scope": "new",
+            }
+        ],
+        "reset": True,
+    },
+    "schedule_playbooks": {
+        "identifier": "schedule_playbooks",
+        "parameters": [
+            {
+                "schedules": json.dumps(
+                    [
+                        {
+                            "delay_purpose": "benchmark",
+                            "duration_unit": unit,
+                            "delay_duration": duration,
+                            "playbook": "local/recheck_indicator",
+                            "playbook_scope": "container/new",
+                            "container_id": container_id,
+                        }
+                        for container_id in range(1, 11)
+                        for unit, duration in (("Minutes", 5), ("Hours", 1), ("Days", 1))
+                    ]
+                )
+            }
+        ],
+        "reset": True,
+    },
+    "execute_playbook_fan_out": {
+        "identifier": "execute_playbook",
+        "parameters": [{"playbook": "local/follow_up", "playbook_scope": "new", "container_filter": '_filter_status="new"'}],
+        "reset": True,
+    },
+    "clear_scheduled_playbooks": {
+        "identifier": "clear_scheduled_playbooks",
+        "parameters": [{"cancellation_reason": "benchmark"}],
+        "reset": True,
+    },
+    "compact_runner_artifacts": {
+        "identifier": "compact_runner_artifacts",
+        "parameters": [{"retention_days": 0, "archive": True}],
+        "reset": True,
+        "settings": {"terminal_fraction": 0.5},
+    },
+    "count_runner_artifacts": {"identifier": "count_runner_artifacts", "parameters": [{"label_filter": "pending"}], "reset": True},
+    "count_runner_artifacts_aggregate": {
+        "identifier": "count_runner_artifacts",
+        "parameters": [{"aggregate": True}],
+        "reset": True,
+        "settings": {"terminal_fraction": 0.5},
+    },
+}
+
+
+def run_action(in_json, state, result_queue):
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    from runner_connector import RunnerConnector
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    connector = RunnerConnector()
+    connector.save_state(state)
+    started = time.perf_counter()
+    output = json.loads(connector._handle_action(json.dumps(in_json), None))
+    elapsed = time.perf_counter() - started
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result_queue.put(
+        {
+            "wall_seconds": round(elapsed, 3),
+            "peak_rss_mb": round(peak_rss / 1024, 1),
+            "action_rss_mb": round((peak_rss - baseline_rss) / 1024, 1),
+            "results": output,
+            "state": connector.load_state(),
+        }
+    )
+
+
+def run_scenario(name, scenario, base_url, config, state):
+    if scenario["reset"]:
+        settings = {"terminal_fraction": 0.0}
+        settings.update(scenario.get("settings", {}))
+        requests.post(f"{base_url}/_bench/reset", data=json.dumps(settings), timeout=600).raise_for_status()
+        state = {}
+    calls_before = requests.get(f"{base_url}/_bench/stats", timeout=60).json()
+    in_json = {
+        "identifier": scenario["identifier"],
+        "config": config,
+        "parameters": scenario["parameters"],
+        "container_id": 1,
+        "asset_id": "1",
+        "base_url": base_url,
+    }
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_action, args=(in_json, state, result_queue))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    calls_after = requests.get(f"{base_url}/_bench/stats", timeout=60).json()
+    result["rest_calls"] = {key: count - calls_before.get(key, 0) for key, count in calls_after.items() if count - calls_before.get(key, 0)}
+    result["scenario"] = name
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark runner connector actions against a mock SOAR REST server")
+    parser.add_argument("--artifacts", type=int, default=100000, help="Number of runner artifacts in the synthetic dataset")
+    parser.add_argument("--containers", type=int, default=5000, help="Number of containers the artifacts are spread over")
+    parser.add_argument("--due-fraction", type=float, default=0.01, help="Fraction of artifacts that are already due")
+    parser.add_argument("--legacy-fraction", type=float, default=0.01, help="Fraction of artifacts without a due timestamp")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency added to every mock REST response")
+    parser.add_argument("--playbook-limit", type=int, default=50, help="playbook_limit asset setting")
+    parser.add_argument("--max-workers", type=int, default=1, help="max_workers asset setting")
+    parser.add_argument("--page-size", type=int, default=100, help="page_size asset setting")
+    parser.add_argument("--config", nargs="*", default=[], metavar="KEY=VALUE", help="Extra asset settings, values are parsed as JSON")
+    parser.add_argument("--scenarios", nargs="*", default=list(SCENARIOS), choices=list(SCENARIOS), help="Scenarios to run")
+    parser.add_argument("--output", help="Optional path to write the results to as JSON")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BENCH_DIR)
+    from mock_soar import serve
+
+    settings = {
+        "artifacts": args.artifacts,
+        "containers": args.containers,
+        "due_fraction": args.due_fraction,
+        "legacy_fraction": args.legacy_fraction,
+    }
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(port_queue, settings, args.latency_ms / 1000), daemon=True)
+    server.start()
+    port = port_queue.get(timeout=600)
+    base_url = f"http://127.0.0.1:{port}"
+    config = {
+        "cluster_api_token": "benchmark",
+        "playbook_limit": args.playbook_limit,
+        "max_workers": args.max_workers,
+        "page_size": args.page_size,
+        "debug": False,
+    }
+    for setting in args.config:
+        key, value = setting.split("=", 1)
+        try:
+            config[key] = json.loads(value)
+        except ValueError:
+            config[key] = value
+
+    results = []
+    state = {}
+    try:
+        for name in args.scenarios:
+            result = run_scenario(name, SCENARIOS[name], base_url, config, state)
+            state = result.pop("state")
+            results.append(result)
+            calls = ", ".join(f"{key}={count}" for key, count in sorted(result["rest_calls"].items()))
+            print(f"{name:<28} wall={result['wall_seconds']:>8.3f}s  peak_rss={result['peak_rss_mb']:>7.1f}MB  calls: {calls}")
+    finally:
+        server.terminate()
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"settings": vars(args), "results": results}, output, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,13 +15,251 @@
 #
 #
 
-import inspect
+import codecs
+import gzip
+import heapq
 import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from itertools import islice
 
 import phantom.app as phantom
 import requests
 from phantom.action_result import ActionResult
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+ARTIFACT_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+DURATION_UNITS = {"Minutes": "minutes", "Hours": "hours", "Days": "days"}
+CATALOG_PAGE_SIZE = 500
+CATALOG_REBUILD_INTERVAL = 86400
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 503)
+RETRY_POST_STATUSES = (429,)
+ARTIFACT_UPDATE_BATCH_SIZE = 50
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_RECONCILE_INTERVAL = 60
+EPOCH = datetime(1970, 1, 1)
+DEFAULT_MIN_RUN_RATE = 0.5
+DEFAULT_MAX_RUN_RATE = 10.0
+THROTTLE_LATENCY_FACTOR = 2.0
+THROTTLE_LATENCY_FLOOR = 0.25
+THROTTLE_EWMA_WEIGHT = 0.2
+TERMINAL_LABELS = ("complete", "halted", "invalid playbook", "coalesced")
+COUNT_LABELS = ("pending", "claimed", *TERMINAL_LABELS)
+DEFAULT_CLAIM_TTL = 15
+CLAIM_FIELDS = ("claimOwner", "claimExpires")
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_TIME_BUDGET = 300
+STREAM_CHUNK_SIZE = 65536
+JSON_NUMBER_CHARACTERS = "0123456789+-.eE"
+SCHEDULE_FIELDS = ("delay_purpose", "duration_unit", "delay_duration", "playbook", "playbook_scope")
+
+
+class RunnerRetry(Retry):
+    # A 429 is the platform rejecting a request before processing it, so it is safe to retry for POSTs too. A 503 may
+    # come from a proxy after the platform started the run or created the artifact, so POSTs are left to the throttle
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code in RETRY_POST_STATUSES:
+            method = "GET"
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = max(round(percent / 100 * len(ordered)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+class AdaptiveThrottle:
+    # Token bucket for the submission rate combined with an AIMD limit on in-flight submissions.
+    # Healthy responses grow both additively, 429/5xx responses or latency spikes halve them.
+    def __init__(self, min_rate, max_rate, max_concurrency, rate=None, concurrency=None):
+        self.condition = threading.Condition()
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.rate = min(max(rate or (min_rate + max_rate) / 2, min_rate), max_rate)
+        self.concurrency = min(max(concurrency or 1.0, 1.0), max_concurrency)
+        self.tokens = 1.0
+        self.refilled = time.monotonic()
+        self.in_flight = 0
+        self.latency = None
+        self.backoffs = 0
+        self.waited = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.refilled) * self.rate, max(self.rate, 1.0))
+        self.refilled = now
+
+    def acquire(self):
+        started = time.monotonic()
+        with self.condition:
+            while True:
+                self._refill()
+                if self.tokens >= 1 and self.in_flight < int(self.concurrency):
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    break
+                timeout = max((1 - self.tokens) / self.rate, 0.01) if self.tokens < 1 else None
+                self.condition.wait(timeout)
+            self.waited += time.monotonic() - started
+
+    def release(self, latency, status_code):
+        with self.condition:
+            self.in_flight -= 1
+            overloaded = status_code is None or status_code == 429 or status_code >= 500
+            if not overloaded:
+                if self.latency is not None and latency > max(self.latency * THROTTLE_LATENCY_FACTOR, THROTTLE_LATENCY_FLOOR):
+                    overloaded = True
+                self.latency = latency if self.latency is None else self.latency + THROTTLE_EWMA_WEIGHT * (latency - self.latency)
+            if overloaded:
+                self.backoffs += 1
+                self.rate = max(self.rate / 2, self.min_rate)
+                self.concurrency = max(self.concurrency / 2, 1.0)
+            else:
+                self.rate = min(self.rate + self.min_rate, self.max_rate)
+                self.concurrency = min(self.concurrency + 1 / self.concurrency, self.max_concurrency)
+            self.condition.notify_all()
+
+    def summary(self):
+        with self.condition:
+            return {
+                "rate": round(self.rate, 2),
+                "concurrency": round(self.concurrency, 2),
+                "backoffs": self.backoffs,
+                "waited_seconds": round(self.waited, 3),
+            }
+
+
+class JsonArrayReader:
+    # Decodes the items of one top level array of a JSON object while the body is read, so only the current chunk
+    # and item are held in memory instead of the raw body, its decoded text and the whole object tree
+    def __init__(self, chunks, key="data"):
+        self.chunks = iter(chunks)
+        self.key = key
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+        self.exhausted = False
+
+    def _fill(self):
+        if self.exhausted:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.exhausted = True
+            text = self.utf8.decode(b"", final=True)
+        else:
+            text = self.utf8.decode(chunk)
+        self.buffer = self.buffer[self.position :] + text
+        self.position = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in " \t\r\n":
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON response")
+
+    def _expect(self, character):
+        if self._peek() != character:
+            raise ValueError(f"Expected {character!r} at {self.buffer[self.position : self.position + 20]!r}")
+        self.position += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # A number may continue in the next chunk when everything after it could still be part of it, e.g. "3."
+                if self.exhausted or self.buffer[end:].strip(JSON_NUMBER_CHARACTERS):
+                    self.position = end
+                    return value
+            except ValueError:
+                if self.exhausted:
+                    raise
+            self._fill()
+
+    def __iter__(self):
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            name = self._value()
+            self._expect(":")
+            if name != self.key:
+                # Other members such as the count are decoded to skip past them but not kept
+                self._value()
+            else:
+                self._expect("[")
+                while self._peek() != "]":
+                    yield self._value()
+                    if self._peek() != "]":
+                        self._expect(",")
+                self.position += 1
+            if self._peek() == "}":
+                return
+            self._expect(",")
+
+
+class RunnerMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.latencies = {}
+        self.errors = Counter()
+        self.counters = Counter()
+        self.lateness = []
+
+    def record_request(self, family, seconds, success):
+        with self.lock:
+            self.latencies.setdefault(family, []).append(seconds)
+            if not success:
+                self.errors[family] += 1
+
+    def increment(self, name, count=1):
+        with self.lock:
+            self.counters[name] += count
+
+    def record_lateness(self, seconds):
+        with self.lock:
+            self.lateness.append(seconds)
+
+    def summary(self):
+        with self.lock:
+            rest_calls = {}
+            for family, latencies in self.latencies.items():
+                rest_calls[family] = {
+                    "count": len(latencies),
+                    "errors": self.errors[family],
+                    "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                    "p90_ms": round(percentile(latencies, 90) * 1000, 1),
+                    "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+                    "max_ms": round(max(latencies) * 1000, 1),
+                }
+            summary = {"elapsed_seconds": round(time.time() - self.started, 3), "rest_calls": rest_calls, "artifacts": dict(self.counters)}
+            if self.lateness:
+                summary["lateness_seconds"] = {
+                    "p50": round(percentile(self.lateness, 50), 1),
+                    "max": round(max(self.lateness), 1),
+                }
+            return summary
 
 
 class RunnerConnector(phantom.BaseConnector):
@@ -29,33 +267,57 @@ class RunnerConnector(phantom.BaseConnector):
     print_debug = None
     headers = {}
     session = None
+    base_url = None
+    max_workers = 1
+    page_size = DEFAULT_PAGE_SIZE
+    shard_index = 0
+    shard_count = 1
+    claim_ttl = DEFAULT_CLAIM_TTL * 60
+    claim_owner = None
+    claim_markers = None
+    coalesce = False
+    coalesce_keys = None
+    container_cache = None
+    cache_hits = 0
+    cache_misses = 0
+    catalog_misses = None
+    executions = 0
+    execution_limit = 0
+    artifact_updates = None
+    artifact_update_results = None
+    touched_containers = None
+    processed_ids = None
+    index_inflight = None
 
     def __init__(self):
         super().__init__()
+        self._state = {}
+        self.state_keys = set()
+        self.lock = threading.Lock()
+        self.catalog_lock = threading.Lock()
+        self.local = threading.local()
+        self.action_thread = threading.current_thread()
+        self.throttle = None
+        self.metrics = RunnerMetrics()
         return
 
-    def __print(self, value, is_debug=False):
-        if self.print_debug is None:
-            self.print_debug = False
-            try:
-                self.print_debug = self.get_config().get("debug")
-            except Exception as e:
-                self.debug_print(f"Exception occurred while getting debug key. Exception: {e}")
-        message = "Failed to cast message to string"
-        source = f"logging: {inspect.stack()[1].function}()"
-        try:
-            message = str(value)
-        except Exception as e:
-            self.debug_print(f"Exception occurred while converting message into string. Exception: {e}")
-            return
-        if is_debug and not self.print_debug:
+    def _debug(self, message, *args):
+        if not self.print_debug:
             return
-        else:
-            self.save_progress(f"{source} {message}")
-            self.debug_print(source, message)
+        if args:
+            message = message % args
+        self.debug_print(f"logging: {sys._getframe(1).f_code.co_name}() {message}")
+
+    def _progress(self, message, *args):
+        if args:
+            message = message % args
+        self.save_progress(message)
+        self.debug_print(f"logging: {sys._getframe(1).f_code.co_name}() {message}")
 
     def _get_base_url(self):
-        self.__print("Start", True)
+        if self.base_url:
+            return self.base_url
+        self._debug("Start")
         base_url = self.get_config().get("cluster_base_url")
         if base_url:
             port = self.get_config().get("https_port")
@@ -64,65 +326,281 @@ class RunnerConnector(phantom.BaseConnector):
             base_url = f"{base_url}:{port}"
         else:
             base_url = self.get_phantom_base_url()
-        self.__print(f"Base URL: {base_url}", True)
+        self._debug("Base URL: %s", base_url)
+        self.base_url = base_url
         return base_url
 
+    def _build_session(self):
+        self._debug("Start")
+        if self.headers:
+            self._debug("API token provided. Using token authed session")
+            session = requests.Session()
+            session.headers.update(self.headers)
+        else:
+            self._debug("No API token provided. Using inherited session from phantom.requests")
+            session = phantom.requests.Session()
+        retries = RunnerRetry(
+            total=RETRY_TOTAL,
+            backoff_factor=RETRY_BACKOFF_FACTOR,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers + 1, max_retries=retries)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _send(self, method, url, data=None, stream=False):
+        self._debug("%s %s", method, url)
+        family = url.split("/rest/", 1)[-1].split("?", 1)[0].split("/", 1)[0]
+        started = time.perf_counter()
+        success = False
+        try:
+            self.local.status_code = None
+            response = self.session.request(method, url, data=data, verify=False, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=stream)
+            self.local.status_code = response.status_code
+            success = 199 < response.status_code < 300
+            return response
+        finally:
+            self.metrics.record_request(family, time.perf_counter() - started, success)
+
+    def _write_metrics(self, action_id, summary):
+        metrics_file = self.get_config().get("metrics_file")
+        if not metrics_file:
+            return
+        record = {"action": action_id, "asset_id": self.get_asset_id(), "timestamp": datetime.utcnow().strftime(ARTIFACT_TIME_FORMAT)}
+        record.update(summary)
+        try:
+            with open(metrics_file, "a") as metrics_log:
+                metrics_log.write(f"{json.dumps(record)}\n")
+        except Exception as e:
+            self._progress("Failed to write metrics to %s. Exception: %s", metrics_file, e)
+
     def _get_rest_data(self, endpoint):
-        self.__print("Start", True)
+        self._debug("Start")
         try:
             url = f"{self._get_base_url()}/{endpoint}"
-            self.__print(url, True)
-            if self.session:
-                response = self.session.get(url, verify=False)
-            else:
-                response = phantom.requests.get(url, verify=False)
+            response = self._send("GET", url)
             content = json.loads(response.text)
             code = response.status_code
             if 199 < code < 300:
-                self.__print(f"GET operation returned {code}")
+                self._debug("GET operation returned %s", code)
                 if "data" in content and "container/" not in url:
                     return content["data"]
                 else:
                     return content
             else:
-                self.__print(f"Response status code: {code}", True)
-                self.__print(response.text)
+                self._debug("Response status code: %s", code)
+                self._progress("%s", response.text)
                 return None
         except Exception as e:
-            self.__print(f"Exception thrown during GET operation: {e}")
-            self.__print(f"GET target: {url}")
+            self._progress("Exception thrown during GET operation: %s", e)
+            self._progress("GET target: %s", url)
             return None
 
     def _post_rest_data(self, endpoint, dictionary):
-        self.__print("Start", True)
+        self._debug("Start")
         try:
             url = f"{self._get_base_url()}/{endpoint}"
-            self.__print(url, True)
             data = json.dumps(dictionary)
-            if self.session:
-                response = self.session.post(url, data=data, verify=False)
-            else:
-                response = phantom.requests.post(url, data=data, verify=False)
-            content = response.text
+            response = self._send("POST", url, data=data)
+            try:
+                content = json.loads(response.text)
+            except ValueError:
+                content = response.text
             code = response.status_code
             if 199 < code < 300:
-                self.__print(f"POST operation returned {code}", True)
-                if "data" in content:
+                self._debug("POST operation returned %s", code)
+                if isinstance(content, dict) and "data" in content:
                     return content["data"]
                 else:
                     return content
             else:
-                self.__print(f"Response status code: {code}")
-                self.__print(response.text)
+                self._progress("Response status code: %s", code)
+                self._progress("%s", response.text)
+                return None
+        except Exception as e:
+            self._progress("Exception thrown during POST operation: %s", e)
+            self._progress("POST target: %s", url)
+            self._progress("POST payload: %s", dictionary)
+            return None
+
+    def _delete_rest_data(self, endpoint, dictionary=None):
+        self._debug("Start")
+        try:
+            url = f"{self._get_base_url()}/{endpoint}"
+            data = json.dumps(dictionary) if dictionary is not None else None
+            response = self._send("DELETE", url, data=data)
+            code = response.status_code
+            if 199 < code < 300:
+                self._debug("DELETE operation returned %s", code)
+                return True
+            else:
+                self._progress("Response status code: %s", code)
+                self._progress("%s", response.text)
+                return False
+        except Exception as e:
+            self._progress("Exception thrown during DELETE operation: %s", e)
+            self._progress("DELETE target: %s", url)
+            return False
+
+    def _count_rest_data(self, endpoint):
+        self._debug("Start")
+        try:
+            # page_size=1 so the platform only serializes a single record next to the count
+            separator = "&" if "?" in endpoint else "?"
+            url = f"{self._get_base_url()}/{endpoint}{separator}page_size=1"
+            response = self._send("GET", url)
+            code = response.status_code
+            if 199 < code < 300:
+                self._debug("GET operation returned %s", code)
+                return json.loads(response.text)["count"]
+            else:
+                self._debug("Response status code: %s", code)
+                self._progress("%s", response.text)
                 return None
         except Exception as e:
-            self.__print(f"Exception thrown during POST operation: {e}")
-            self.__print(f"POST target: {url}")
-            self.__print(f"POST payload: {dictionary}")
+            self._progress("Exception thrown during count operation: %s", e)
+            self._progress("GET target: %s", url)
             return None
 
-    def _create_artifact(self, comment, unit, duration, playbook, scope, container, input_data):
-        self.__print("Start", True)
+    def _stream_rest_data(self, endpoint):
+        self._debug("Start")
+        url = f"{self._get_base_url()}/{endpoint}"
+        with self._send("GET", url, stream=True) as response:
+            code = response.status_code
+            if not 199 < code < 300:
+                self._progress("Response status code: %s", code)
+                self._progress("%s", response.text)
+                raise Exception(f"GET operation returned {code} for {endpoint}")
+            yield from JsonArrayReader(response.iter_content(STREAM_CHUNK_SIZE))
+
+    def _iter_rest_data(self, endpoint, page_size, last_id=0):
+        self._debug("Start")
+        separator = "&" if "?" in endpoint else "?"
+        while True:
+            uri = f"{endpoint}{separator}page_size={page_size}&_filter_id__gt={last_id}&sort=id&order=asc"
+            received = 0
+            try:
+                for item in self._stream_rest_data(uri):
+                    received += 1
+                    last_id = item["id"]
+                    yield item
+            except (requests.RequestException, ValueError) as e:
+                raise Exception(f"Failed to retrieve page after id {last_id} from {endpoint}. Exception: {e}")
+            if received < page_size:
+                return
+
+    def _build_playbook_catalog(self, catalog, watermark=None):
+        self._debug("Start")
+        repos = {repo["id"]: repo["name"] for repo in self._iter_rest_data("rest/scm", CATALOG_PAGE_SIZE)}
+        endpoint = "rest/playbook"
+        if watermark:
+            endpoint = f'{endpoint}?_filter_modified_time__gt="{watermark}"'
+        # Stored playbook ids are only re-resolved when an entry they could point at changed or disappeared
+        previous = {name: (entry["id"], entry["labels"]) for name, entry in catalog.get("entries", {}).items()}
+        if watermark is None:
+            entries = {}
+            catalog["watermark"] = None
+        else:
+            entries = catalog["entries"]
+        latest_ids = {name: entry["id"] for name, entry in entries.items()}
+        for playbook in self._iter_rest_data(endpoint, CATALOG_PAGE_SIZE):
+            repo = repos.get(playbook["scm"])
+            if repo is None:
+                continue
+            name = f"{repo}/{playbook['name']}"
+            if playbook["id"] < latest_ids.get(name, 0):
+                continue
+            latest_ids[name] = playbook["id"]
+            entries[name] = {"id": playbook["id"], "labels": playbook.get("labels") or [], "active": playbook.get("active", False)}
+            modified_time = playbook.get("modified_time")
+            if modified_time and modified_time > (catalog.get("watermark") or ""):
+                catalog["watermark"] = modified_time
+        catalog["entries"] = entries
+        if any(name not in entries or (entries[name]["id"], entries[name]["labels"]) != key for name, key in previous.items()):
+            catalog["version"] = catalog.get("version", 0) + 1
+        self._debug("Playbook catalog holds %s playbooks, version %s", len(entries), catalog.get("version", 0))
+
+    def _get_playbook_catalog(self):
+        self._debug("Start")
+        catalog = self._state.setdefault("playbook_catalog", {})
+        now = time.time()
+        try:
+            ttl = int(self.get_config().get("catalog_ttl") or 60) * 60
+        except Exception:
+            ttl = 3600
+        if "entries" in catalog and now - catalog.get("refreshed", 0) < ttl:
+            return catalog
+        with self.catalog_lock:
+            if "entries" in catalog and time.time() - catalog.get("refreshed", 0) < ttl:
+                return catalog
+            try:
+                if "entries" in catalog and catalog.get("watermark") and now - catalog.get("built", 0) < CATALOG_REBUILD_INTERVAL:
+                    self._debug("Refreshing playbook catalog from watermark")
+                    try:
+                        self._build_playbook_catalog(catalog, catalog["watermark"])
+                    except Exception as e:
+                        self._debug("Incremental catalog refresh failed, rebuilding. Exception: %s", e)
+                        self._build_playbook_catalog(catalog)
+                        catalog["built"] = now
+                else:
+                    self._debug("Building playbook catalog")
+                    self._build_playbook_catalog(catalog)
+                    catalog["built"] = now
+                catalog["refreshed"] = now
+                self.state_keys.add("playbook_catalog")
+            except Exception as e:
+                self._progress("Failed to refresh playbook catalog. Exception: %s", e)
+                catalog.setdefault("entries", {})
+                catalog["refreshed"] = now
+        return catalog
+
+    def _lookup_playbook(self, playbook):
+        self._debug("Start")
+        catalog = self._get_playbook_catalog()
+        entry = catalog["entries"].get(playbook)
+        if entry is not None:
+            return entry
+        if self.catalog_misses is None:
+            self.catalog_misses = set()
+        if playbook in self.catalog_misses:
+            return None
+        self._debug("Playbook %s is not in the catalog, looking it up directly", playbook)
+        playbook_json = self._playbook_exists(playbook)
+        if not playbook_json:
+            self.catalog_misses.add(playbook)
+            return None
+        entry = {"id": playbook_json[0]["id"], "labels": playbook_json[0].get("labels") or [], "active": playbook_json[0].get("active", False)}
+        catalog["entries"][playbook] = entry
+        self.state_keys.add("playbook_catalog")
+        return entry
+
+    def _get_due_fields(self, unit, duration):
+        self._debug("Start")
+        due_timestamp = int(time.time() + timedelta(**{DURATION_UNITS[unit]: int(duration)}).total_seconds())
+        due_time = datetime.utcfromtimestamp(due_timestamp).strftime(ARTIFACT_TIME_FORMAT)
+        return {"dueTimestamp": due_timestamp, "dueTime": due_time}
+
+    def _parse_scope(self, param):
+        self._debug("Start")
+        scope = param.get("playbook_scope")
+        container = None
+        if scope == "artifact":
+            ids = []
+            ids.append(param.get("artifact_id"))
+            scope = ids
+        if "container" in scope:
+            container = param.get("container_id")
+            if "all" in scope:
+                scope = "all"
+            elif "new" in scope:
+                scope = "new"
+        return scope, container
+
+    def _build_artifact(self, comment, unit, duration, playbook, scope, container, input_data, resolution=None, priority=None):
+        self._debug("Start")
         container_id = container
         if not container:
             container_id = self.get_container_id()
@@ -136,8 +614,24 @@ class RunnerConnector(phantom.BaseConnector):
         }
         if input_data:
             artifact_dict["cef"]["inputs"] = input_data
+        if resolution:
+            artifact_dict["cef"].update(resolution)
+        if priority not in (None, ""):
+            artifact_dict["cef"]["priority"] = int(priority)
+        if unit in DURATION_UNITS and duration is not None:
+            artifact_dict["cef"].update(self._get_due_fields(unit, duration))
+        return artifact_dict
+
+    def _create_artifact(self, comment, unit, duration, playbook, scope, container, input_data, resolution=None, priority=None):
+        self._debug("Start")
+        artifact_dict = self._build_artifact(comment, unit, duration, playbook, scope, container, input_data, resolution, priority)
         if comment and unit:
-            self.__print(f"Posting artifact: {artifact_dict}", True)
+            if self.coalesce and "dueTimestamp" in artifact_dict["cef"]:
+                existing = self._find_pending_duplicate(artifact_dict)
+                if existing is not None and self._merge_schedule(existing, artifact_dict):
+                    self._progress("Merged into pending schedule %s", existing["id"])
+                    return True
+            self._debug("Posting artifact: %s", artifact_dict)
             uri = "rest/artifact"
             response = self._post_rest_data(uri, artifact_dict)
             if response is not None:
@@ -145,37 +639,125 @@ class RunnerConnector(phantom.BaseConnector):
             else:
                 return False
         else:
-            self.__print("Artifact details are for an immediate execution, skipping artifact generation")
+            self._progress("Artifact details are for an immediate execution, skipping artifact generation")
             return artifact_dict
 
+    def _coalesce_key(self, container_id, cef):
+        return (int(container_id), cef.get("playbook"), json.dumps(cef.get("scope")), json.dumps(cef.get("inputs"), sort_keys=True))
+
+    def _get_delay_seconds(self, cef):
+        try:
+            return int(timedelta(**{DURATION_UNITS[cef["durationUnit"]]: int(cef["duration"])}).total_seconds())
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _find_pending_duplicate(self, artifact_dict):
+        self._debug("Start")
+        cef = artifact_dict["cef"]
+        # A repeated request with the same delay is merged into the nearest pending schedule due within one delay
+        # of it. Requiring the same delay keeps deliberate follow-ups such as 5m/1h/24h re-checks apart.
+        due_timestamp = cef["dueTimestamp"]
+        delay = self._get_delay_seconds(cef)
+        if delay is None:
+            return None
+        uri = (
+            f'rest/artifact?_filter_container={artifact_dict["container_id"]}&_filter_name="scheduled playbook"&_filter_label="pending"'
+            f'&_filter_cef__playbook="{cef["playbook"]}"&_filter_cef__dueTimestamp__gte={due_timestamp - delay}'
+            f"&_filter_cef__dueTimestamp__lte={due_timestamp + delay}"
+        )
+        key = self._coalesce_key(artifact_dict["container_id"], cef)
+        duplicates = (
+            artifact
+            for artifact in self._iter_rest_data(uri, self.page_size)
+            if self._coalesce_key(artifact["container"], artifact["cef"]) == key and self._get_delay_seconds(artifact["cef"]) == delay
+        )
+        return min(duplicates, key=lambda artifact: abs(self._get_due_timestamp(artifact) - due_timestamp), default=None)
+
+    def _merge_schedule(self, existing, artifact_dict):
+        self._debug("Start")
+        cef = dict(existing["cef"])
+        new = artifact_dict["cef"]
+        # An earlier schedule is extended to the new due time, a later one already covers the new request. Neither
+        # ever runs before its own request asked for.
+        if new["dueTimestamp"] > self._get_due_timestamp(existing):
+            cef.update({"dueTimestamp": new["dueTimestamp"], "dueTime": new["dueTime"]})
+        cef["coalescedCount"] = int(cef.get("coalescedCount") or 0) + 1
+        if "priority" in new:
+            cef["priority"] = max(self._get_priority(existing), new["priority"])
+        for key in ("playbookId", "catalogVersion"):
+            if key in new:
+                cef[key] = new[key]
+        if self._post_rest_data(f"rest/artifact/{existing['id']}", {"cef": cef}) is None:
+            return False
+        # Without a conditional update the schedule may have run meanwhile, in which case a new one is created instead
+        current = self._get_rest_data(f"rest/artifact/{existing['id']}")
+        return current is not None and current.get("label") == "pending"
+
+    def _queue_artifact_update(self, artifact_id, update_data):
+        with self.lock:
+            self.artifact_updates.append((artifact_id, update_data))
+            should_flush = len(self.artifact_updates) >= ARTIFACT_UPDATE_BATCH_SIZE
+        # Dispatch workers only queue, a flush started inside one would open a second pool next to the dispatch pool
+        # and exhaust the session's connection pool. The action thread flushes them between pages.
+        if should_flush and threading.current_thread() is self.action_thread:
+            self._flush_artifact_updates()
+
+    def _post_artifact_update(self, update):
+        artifact_id, update_data = update
+        success = self._post_rest_data(f"rest/artifact/{artifact_id}", update_data) is not None
+        return artifact_id, {"label": update_data["label"], "success": success}
+
+    def _flush_artifact_updates(self):
+        self._debug("Start")
+        with self.lock:
+            updates = self.artifact_updates or []
+            self.artifact_updates = []
+        if not updates:
+            return {}
+        self._debug("Flushing %s artifact updates", len(updates))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = dict(executor.map(self._post_artifact_update, updates))
+        for artifact_id, result in results.items():
+            if not result["success"]:
+                self._progress("Failed to mark artifact %s as %s", artifact_id, result["label"])
+        with self.lock:
+            self.artifact_update_results.update(results)
+        return results
+
     def _disable_artifact(self, container, reason):
-        self.__print("Start", True)
-        uri = f'rest/container/{container}/artifacts?_filter_name="scheduled playbook"&_filter_label="pending"'
-        response = self._get_rest_data(uri)
-        update_data = {"label": "halted"}
-        for artifact in response["data"]:
-            update_data["cef"] = artifact["cef"]
-            update_data["cef"]["exeComment"] = reason
-            update_data["id"] = artifact["id"]
-            uri = f"rest/artifact/{artifact['id']}"
-            response = self._post_rest_data(uri, update_data)
-        return
+        self._debug("Start")
+        uri = f'rest/artifact?_filter_container={container}&_filter_name="scheduled playbook"&_filter_label="pending"'
+        self.artifact_updates = []
+        self.artifact_update_results = {}
+        for artifact in self._iter_rest_data(uri, self.page_size):
+            cef = dict(artifact["cef"])
+            cef["exeComment"] = reason
+            self._queue_artifact_update(artifact["id"], {"id": artifact["id"], "label": "halted", "cef": cef})
+        self._flush_artifact_updates()
+        results = self.artifact_update_results
+        self.artifact_updates = None
+        self.artifact_update_results = None
+        return results
 
-    def _add_waiting_tag(self):
-        self.__print("Start", True)
-        uri = f"rest/container/{self.get_container_id()}"
-        response = self._get_rest_data(uri)
-        self.__print(response, is_debug=True)
+    def _add_waiting_tag(self, container_id=None):
+        self._debug("Start")
+        container_id = int(container_id or self.get_container_id())
+        uri = f"rest/container/{container_id}"
+        # The container was usually just fetched to validate the playbook, so go through the cache
+        response = self._get_container(container_id)
+        self._debug("%s", response)
         tags = response["tags"]
-        if "waiting" not in tags:
-            tags.append("waiting")
+        if "waiting" in tags:
+            self._debug("Container already has the waiting tag")
+            return
+        tags.append("waiting")
         update_data = {}
         update_data["tags"] = tags
         response = self._post_rest_data(uri, update_data)
         return
 
     def _delete_waiting_tag(self, container):
-        self.__print("Start", True)
+        self._debug("Start")
         uri = f"rest/container/{container}"
         response = self._get_rest_data(uri)
         tags = response["tags"]
@@ -186,114 +768,206 @@ class RunnerConnector(phantom.BaseConnector):
         response = self._post_rest_data(uri, update_data)
         return
 
+    def _resolve_playbook(self, playbook, container):
+        self._debug("Start")
+        entry = self._lookup_playbook(playbook)
+        if entry is None:
+            return None
+        if container["label"] not in entry["labels"] and "*" not in entry["labels"]:
+            return None
+        return {"playbookId": entry["id"], "catalogVersion": self._get_playbook_catalog().get("version", 0)}
+
+    def _resolve_for_container(self, playbook, container_id):
+        self._debug("Start")
+        container_id = int(container_id or self.get_container_id())
+        container = self._get_container(container_id)
+        if container is None:
+            raise Exception(f"Container {container_id} could not be retrieved")
+        resolution = self._resolve_playbook(playbook, container)
+        if resolution is None:
+            raise Exception(f"Playbook {playbook} does not exist or cannot run on containers labeled {container['label']}")
+        return resolution
+
     def _is_playbook_valid(self, artifact, container):
-        self.__print("Start", True)
-        is_valid = False
-        playbook = self._playbook_exists(artifact["cef"]["playbook"])
-        if playbook is not None and playbook != []:
-            if container["label"] in playbook[0]["labels"] or "*" in playbook[0]["labels"]:
-                is_valid = True
-        return is_valid
+        self._debug("Start")
+        cef = artifact["cef"]
+        if cef.get("playbookId") is not None and cef.get("catalogVersion") == self._get_playbook_catalog().get("version", 0):
+            self._debug("Playbook was resolved at schedule time")
+            return True
+        resolution = self._resolve_playbook(cef["playbook"], container)
+        if resolution is None:
+            return False
+        cef.update(resolution)
+        return True
 
     def _playbook_exists(self, playbook):
-        self.__print("Start", True)
+        self._debug("Start")
         playbook_json = None
         if "/" not in playbook:
-            self.__print(f"Playbook format is incorrect. {playbook} should be of the format <repo name>/<playbook name>")
+            self._progress("Playbook format is incorrect. %s should be of the format <repo name>/<playbook name>", playbook)
             return playbook_json
         playbook_string = playbook.split("/")
         repo = playbook_string[0]
         playbook = playbook_string[1]
-        self.__print("Getting repo numeric ID", True)
+        self._debug("Getting repo numeric ID")
         uri = f'rest/scm?page_size=0&_filter_name="{repo}"'
         repo_data = self._get_rest_data(uri)
         if repo_data is not None and repo_data != []:
-            self.__print("Getting playbook data", True)
+            self._debug("Getting playbook data")
             uri = f'rest/playbook?page_size=1&_filter_name="{playbook}"&_filter_scm={repo_data[0]["id"]}'
             playbook_json = self._get_rest_data(uri)
         return playbook_json
 
-    def _get_all_pending_artifacts(self):
-        self.__print("Start", True)
+    def _iter_pending_artifacts(self, page_size):
+        self._debug("Start")
+        base_uri = 'rest/artifact?_filter_label="pending"&_filter_name__contains="scheduled playbook"'
+        due_artifacts = self._iter_rest_data(f"{base_uri}&_filter_cef__dueTimestamp__lte={int(time.time())}", page_size)
+        legacy_artifacts = self._iter_rest_data(f"{base_uri}&_filter_cef__dueTimestamp__isnull=True", page_size)
+        artifacts = heapq.merge(due_artifacts, legacy_artifacts, key=lambda artifact: artifact["id"])
+        return (artifact for artifact in artifacts if self._in_shard(artifact["container"]))
+
+    def _get_expiration(self, artifact):
+        self._debug("Start")
+        due_timestamp = artifact["cef"].get("dueTimestamp")
+        if due_timestamp is not None:
+            return datetime.utcfromtimestamp(int(due_timestamp))
+        unit = artifact["cef"]["durationUnit"]
+        duration = artifact["cef"]["duration"]
+        self._debug("Creation time: %s", artifact["create_time"])
+        return datetime.strptime(artifact["create_time"], ARTIFACT_TIME_FORMAT) + timedelta(**{DURATION_UNITS[unit]: int(duration)})
+
+    def _get_due_timestamp(self, artifact):
+        due_timestamp = artifact["cef"].get("dueTimestamp")
+        if due_timestamp is not None:
+            return int(due_timestamp)
+        return int((self._get_expiration(artifact) - EPOCH).total_seconds())
+
+    def _get_priority(self, artifact):
         try:
-            uri = 'rest/artifact?page_size=0&_filter_label="pending"&_filter_name__contains="scheduled playbook"&sort=id&order=asc'
-            pending_artifacts = self._get_rest_data(uri)
-            return pending_artifacts
-        except Exception as e:
-            self.__print("Failed to retrieved pending scheduled playbooks")
-            self.__print(e)
-            return None
+            return int(artifact["cef"].get("priority") or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def _index_entry(self, artifact):
+        return [self._get_due_timestamp(artifact), artifact["id"], artifact["container"], self._get_priority(artifact)]
 
     def _is_expired(self, artifact):
-        self.__print("Start", True)
+        self._debug("Start")
         is_expired = False
-        unit = artifact["cef"]["durationUnit"]
-        duration = artifact["cef"]["duration"]
-        if unit == "Minutes":
-            expiration = datetime.strptime(artifact["create_time"], "%Y-%m-%dT%H:%M:%S.%fZ") + timedelta(minutes=int(duration))
-        elif unit == "Hours":
-            expiration = datetime.strptime(artifact["create_time"], "%Y-%m-%dT%H:%M:%S.%fZ") + timedelta(hours=int(duration))
-        elif unit == "Days":
-            expiration = datetime.strptime(artifact["create_time"], "%Y-%m-%dT%H:%M:%S.%fZ") + timedelta(days=int(duration))
-        self.__print(f"Current time: {datetime.utcnow()}", True)
-        self.__print(f"Expiration time: {expiration}", True)
-        self.__print(f"Creation time: {artifact['create_time']}", True)
+        expiration = self._get_expiration(artifact)
+        self._debug("Current time: %s", datetime.utcnow())
+        self._debug("Expiration time: %s", expiration)
         if expiration <= datetime.utcnow():
             is_expired = True
-            self.__print(f"Artifact {artifact['id']} wait time has expired")
+            self._debug("Artifact %s wait time has expired", artifact["id"])
         return is_expired
 
-    def _get_container(self, artifact):
-        self.__print("Start", True)
-        uri = f"rest/container/{artifact['container']}"
+    def _prefetch_containers(self, container_ids):
+        self._debug("Start")
+        if self.container_cache is None:
+            return
+        missing = sorted(container_id for container_id in set(container_ids) if container_id not in self.container_cache)
+        if not missing:
+            return
+        uri = f"rest/container?page_size=0&_filter_id__in={json.dumps(missing)}"
+        containers = self._get_rest_data(uri)
+        if containers is None:
+            self._progress("Failed to prefetch containers, falling back to individual lookups")
+            return
+        for container in containers:
+            self.container_cache[container["id"]] = container
+        self._debug("Prefetched %s containers", len(containers))
+
+    def _get_container(self, container_id):
+        self._debug("Start")
+        if self.container_cache is not None and container_id in self.container_cache:
+            with self.lock:
+                self.cache_hits += 1
+            return self.container_cache[container_id]
+        with self.lock:
+            self.cache_misses += 1
+        uri = f"rest/container/{container_id}"
         container = self._get_rest_data(uri)
+        if self.container_cache is not None and container is not None:
+            self.container_cache[container_id] = container
         return container
 
     def _run_playbook(self, artifact):
-        self.__print("Start", True)
-        self.__print(artifact, is_debug=True)
+        self._debug("Start")
+        self._debug("%s", artifact)
         success = False
         uri = "rest/playbook_run"
         try:
             container_id = int(artifact["container_id"])
         except:
             container_id = int(artifact["container"])
-        data = {"container_id": container_id, "playbook_id": artifact["cef"]["playbook"], "scope": artifact["cef"]["scope"], "run": "true"}
+        playbook_id = artifact["cef"].get("playbookId") or artifact["cef"]["playbook"]
+        data = {"container_id": container_id, "playbook_id": playbook_id, "scope": artifact["cef"]["scope"], "run": "true"}
         try:
             data["inputs"] = artifact["cef"]["inputs"]
         except:
             pass
-        self.__print(f"Playbook run payload: {data}", True)
-        result = self._post_rest_data(uri, data)
+        self._debug("Playbook run payload: %s", data)
+        if self.throttle is None:
+            result = self._post_rest_data(uri, data)
+        else:
+            self.throttle.acquire()
+            started = time.perf_counter()
+            try:
+                result = self._post_rest_data(uri, data)
+            finally:
+                self.throttle.release(time.perf_counter() - started, getattr(self.local, "status_code", None))
         if result is not None:
             success = True
         return success, result
 
-    def _is_playbook_pending(self, artifact):
-        self.__print("Start", True)
-        is_playbook_pending = False
-        uri = f'rest/container/{artifact["container"]}/artifacts?page_size=0&_filter_label="pending"&_filter_name__contains="scheduled playbook"'
-        playbooks = self._get_rest_data(uri)
-        if playbooks["data"] != []:
-            is_playbook_pending = True
-        return is_playbook_pending
-
-    def _delete_tag(self, state, artifact):
-        self.__print("Start", True)
-        uri = f"rest/container/{artifact['container']}"
-        response = self._get_rest_data(uri)
+    def _delete_tag(self, state, container_id):
+        self._debug("Start")
+        uri = f"rest/container/{container_id}"
+        container = self._get_container(container_id)
         tags = []
-        tags.extend(response["tags"])
-        self.__print(tags, is_debug=True)
-        if state in tags:
-            tags.remove(state)
+        tags.extend(container["tags"])
+        self._debug("%s", tags)
+        if state not in tags:
+            self._debug("Tag %s is not present on container %s", state, container_id)
+            return False
+        tags.remove(state)
         update_data = {}
         update_data["tags"] = tags
         response = self._post_rest_data(uri, update_data)
-        return
+        if response is None:
+            return False
+        container["tags"] = tags
+        return True
+
+    def _count_pending_artifacts(self, container_id):
+        uri = (
+            f'rest/artifact?_filter_label__in={json.dumps(["pending", "claimed"])}&_filter_name__contains="scheduled playbook"'
+            f"&_filter_container={container_id}"
+        )
+        # Only existence matters, so a count over one record instead of reading every pending schedule
+        return container_id, self._count_rest_data(uri)
+
+    def _reconcile_waiting_tags(self, container_ids):
+        self._debug("Start")
+        if not container_ids:
+            return 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            counts = dict(executor.map(self._count_pending_artifacts, sorted(container_ids)))
+        removed = 0
+        for container_id, count in sorted(counts.items()):
+            if count is None:
+                self._progress("Failed to count pending artifacts on container %s, leaving its waiting tag in place", container_id)
+                continue
+            if count:
+                continue
+            self._debug("No playbooks pending on container %s", container_id)
+            if self._delete_tag("waiting", container_id):
+                removed += 1
+        return removed
 
     def _update_artifact(self, state, artifact, result=None):
-        self.__print("Start", True)
+        self._debug("Start")
         update_data = {}
         update_data["cef"] = {}
         update_data["cef"].update(artifact["cef"])
@@ -301,36 +975,36 @@ class RunnerConnector(phantom.BaseConnector):
         if result:
             update_data["cef"]["rest_response"] = result
         update_data["label"] = state
+        self._debug("Updating artifact with %s", update_data)
+        if self.artifact_updates is not None:
+            self._queue_artifact_update(artifact["id"], update_data)
+            return
         uri = f"rest/artifact/{artifact['id']}"
-        self.__print(f"Updating artifact with {update_data}", True)
         self._post_rest_data(uri, update_data)
         return
 
     def _handle_test_connectivity(self, param, action_result):
-        self.__print("Start", True)
+        self._debug("Start")
         test_url = f"{self._get_base_url()}/rest/version"
-        self.__print(f"Attempting GET for {test_url}")
+        self._progress("Attempting GET for %s", test_url)
         response = None
         try:
-            if self.session:
-                response = self.session.get(test_url, verify=False)
-            else:
-                response = phantom.requests.get(test_url, verify=False)
-            self.__print(response.status_code, True)
+            response = self._send("GET", test_url)
+            self._debug("%s", response.status_code)
         except:
             pass
         if response and 199 < response.status_code < 300:
             version = json.loads(response.text)["version"]
-            self.__print(f"Successfully retrieved platform version: {version}")
-            self.__print("Passed connection test")
+            self._progress("Successfully retrieved platform version: %s", version)
+            self._progress("Passed connection test")
             return action_result.set_status(phantom.APP_SUCCESS, "Passed connection test")
         else:
-            self.__print(f"Failed to reach test url: {test_url}\nCheck your hostname config value")
-            self.__print("Failed connection test")
+            self._progress("Failed to reach test url: %s\nCheck your hostname config value", test_url)
+            self._progress("Failed connection test")
             return action_result.set_status(phantom.APP_ERROR, f"Failed to reach test url {test_url}")
 
     def _process_input_data(self, param):
-        self.__print("Start", True)
+        self._debug("Start")
         input_data = None
         try:
             input_data = param.get("input_data")
@@ -343,191 +1017,834 @@ class RunnerConnector(phantom.BaseConnector):
                         temp = json.loads(temp)
                         input_data = temp
                     except:
-                        self.__print("Input data was provided but could not be loaded as json. Please check the input data format.")
-                        self.__print(param.get("input_data"))
+                        self._progress("Input data was provided but could not be loaded as json. Please check the input data format.")
+                        self._progress("%s", param.get("input_data"))
                         self.set_status(phantom.APP_ERROR, "Artifact creation failed")
                         return phantom.APP_ERROR
         except:
             pass
         return input_data
 
+    def _aggregate_runner_artifacts(self, endpoint, total, label_filter=None, playbook_filter=None):
+        self._debug("Start")
+        labels = [label_filter] if label_filter else list(COUNT_LABELS)
+        playbooks = [playbook_filter] if playbook_filter else sorted(self._get_playbook_catalog()["entries"])
+        # Counting per playbook costs one request per catalog entry, scanning costs one per page, so pick the cheaper one
+        scan = not playbook_filter and -(-total // self.page_size) < len(playbooks)
+        endpoints = []
+        if not label_filter:
+            endpoints += [f'{endpoint}&_filter_label="{label}"' for label in labels]
+        if not (playbook_filter or scan):
+            endpoints += [f'{endpoint}&_filter_cef__playbook="{playbook}"' for playbook in playbooks]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            counts = list(executor.map(self._count_rest_data, endpoints))
+        if None in counts:
+            raise Exception("Failed to retrieve runner artifact counts")
+        label_counts = {label_filter: total} if label_filter else dict(zip(labels, counts))
+        if playbook_filter:
+            playbook_counts = {playbook_filter: total}
+        elif scan:
+            self._debug("Scanning %s runner artifacts to group them by playbook", total)
+            playbook_counts = Counter(artifact["cef"].get("playbook") or "other" for artifact in self._iter_rest_data(endpoint, self.page_size))
+        else:
+            playbook_counts = {playbook: count for playbook, count in zip(playbooks, counts[-len(playbooks) :]) if count}
+        # Labels and playbooks outside the known sets are reported together as "other"
+        for grouped in (label_counts, playbook_counts):
+            if total > sum(grouped.values()):
+                grouped["other"] = total - sum(grouped.values())
+        labels = [{"label": label, "count": count} for label, count in label_counts.items()]
+        playbooks = [{"playbook": playbook, "count": count} for playbook, count in sorted(playbook_counts.items())]
+        return labels, playbooks
+
     def _handle_count_runner_artifacts(self, param, action_result):
-        self.__print("Start", True)
-        url_params = ['_filter_name="scheduled playbook"', "page_size=0"]
-        path_values = ["rest", "container", str(self.get_container_id()), "artifacts"]
+        self._debug("Start")
+        url_params = ['_filter_name="scheduled playbook"']
+        aggregate = param.get("aggregate", False)
         try:
-            playbook_filter = param.get("playbook_filter")
-            if playbook_filter:
-                url_params.append(f'_filter_cef__playbook="{playbook_filter}"')
-        except:
-            pass
-        try:
-            label_filter = param.get("label_filter")
-            if label_filter:
-                url_params.append(f'_filter_label="{label_filter}"')
-        except:
-            pass
-        endpoint = f"{'/'.join(path_values)}?{'&'.join(url_params)}"
-        self.__print(endpoint, is_debug=True)
-        artifact_count = None
-        artifact_count = self._get_rest_data(endpoint)["count"]
-        if artifact_count is not None:
-            action_result.add_data({"runner_artifact_count": artifact_count})
-            self.__print(f"Runner artifact count: {artifact_count}", True)
-            return action_result.set_status(phantom.APP_SUCCESS, "Successfully completed artifact count")
-        else:
-            self.__print("Failed to retrieve runner artifact count")
+            container_ids = [int(container_id) for container_id in str(param.get("container_ids") or "").split(",") if container_id.strip()]
+        except ValueError as e:
+            return action_result.set_status(phantom.APP_ERROR, f"Container ids must be a comma separated list of numbers. Exception: {e}")
+        if container_ids:
+            url_params.append(f"_filter_container__in={json.dumps(container_ids)}")
+        elif not aggregate:
+            url_params.append(f"_filter_container={self.get_container_id()}")
+        playbook_filter = param.get("playbook_filter")
+        if playbook_filter:
+            url_params.append(f'_filter_cef__playbook="{playbook_filter}"')
+        label_filter = param.get("label_filter")
+        if label_filter:
+            url_params.append(f'_filter_label="{label_filter}"')
+        endpoint = f"rest/artifact?{'&'.join(url_params)}"
+        self._debug("%s", endpoint)
+        artifact_count = self._count_rest_data(endpoint)
+        if artifact_count is None:
+            self._progress("Failed to retrieve runner artifact count")
             return action_result.set_status(phantom.APP_ERROR, "Failed to retrieve runner artifact count")
+        data = {"runner_artifact_count": artifact_count}
+        self._debug("Runner artifact count: %s", artifact_count)
+        if aggregate:
+            try:
+                data["labels"], data["playbooks"] = self._aggregate_runner_artifacts(endpoint, artifact_count, label_filter, playbook_filter)
+            except Exception as e:
+                self._progress("Action failed with exception")
+                self._progress("%s", e)
+                return action_result.set_status(phantom.APP_ERROR, f"Failed to aggregate runner artifact counts. Exception: {e}")
+        action_result.add_data(data)
+        action_result.update_summary({"runner_artifact_count": artifact_count})
+        return action_result.set_status(phantom.APP_SUCCESS, "Successfully completed artifact count")
 
     def _handle_schedule_playbook(self, param, action_result):
-        self.__print("Start", True)
+        self._debug("Start")
         try:
-            self.__print("Building standard delayed execution artifact", True)
+            self._debug("Building standard delayed execution artifact")
             comment = param.get("delay_purpose")
             unit = param.get("duration_unit")
             duration = param.get("delay_duration")
             playbook = param.get("playbook")
-            scope = param.get("playbook_scope")
-            container = None
-            if scope == "artifact":
-                ids = []
-                ids.append(param.get("artifact_id"))
-                scope = ids
-            if "container" in scope:
-                container = param.get("container_id")
-                if "all" in scope:
-                    scope = "all"
-                elif "new" in scope:
-                    scope = "new"
+            scope, container = self._parse_scope(param)
             input_data = self._process_input_data(param)
             if input_data == phantom.APP_ERROR:
                 return phantom.APP_ERROR
-            if not self._create_artifact(comment, unit, duration, playbook, scope, container, input_data):
+            self.container_cache = {}
+            resolution = self._resolve_for_container(playbook, container)
+            if not self._create_artifact(comment, unit, duration, playbook, scope, container, input_data, resolution, param.get("priority")):
                 return action_result.set_status(phantom.APP_ERROR, "Artifact creation failed")
             self._add_waiting_tag()
             return action_result.set_status(phantom.APP_SUCCESS, "Successfully completed execution delay")
         except Exception as e:
-            self.__print("Action failed with exception")
-            self.__print(e)
+            self._progress("Action failed with exception")
+            self._progress("%s", e)
             return action_result.set_status(phantom.APP_ERROR, e)
 
+    def _handle_schedule_playbooks(self, param, action_result):
+        self._debug("Start")
+        try:
+            try:
+                schedules = json.loads(param.get("schedules"))
+            except Exception as e:
+                return action_result.set_status(phantom.APP_ERROR, f"Schedules could not be loaded as json. Exception: {e}")
+            if not isinstance(schedules, list) or not schedules:
+                return action_result.set_status(phantom.APP_ERROR, "Schedules must be a non-empty json list")
+            artifacts = []
+            for index, schedule in enumerate(schedules):
+                if not isinstance(schedule, dict):
+                    return action_result.set_status(phantom.APP_ERROR, f"Schedule {index} must be an object")
+                missing = [key for key in SCHEDULE_FIELDS if schedule.get(key) in (None, "")]
+                if missing:
+                    return action_result.set_status(phantom.APP_ERROR, f"Schedule {index} is missing {', '.join(missing)}")
+                if schedule["duration_unit"] not in DURATION_UNITS:
+                    return action_result.set_status(phantom.APP_ERROR, f"Schedule {index} has an invalid duration_unit")
+                scope, container = self._parse_scope(schedule)
+                input_data = schedule.get("input_data")
+                if isinstance(input_data, str):
+                    input_data = self._process_input_data(schedule)
+                    if input_data == phantom.APP_ERROR:
+                        return action_result.set_status(phantom.APP_ERROR, f"Schedule {index} has invalid input_data")
+                artifact = self._build_artifact(
+                    schedule["delay_purpose"],
+                    schedule["duration_unit"],
+                    schedule["delay_duration"],
+                    schedule["playbook"],
+                    scope,
+                    container,
+                    input_data,
+                    priority=schedule.get("priority"),
+                )
+                artifact["source_data_identifier"] = f"{artifact['source_data_identifier']}-{index}"
+                artifacts.append(artifact)
+            self.container_cache = {}
+            self._prefetch_containers(int(artifact["container_id"]) for artifact in artifacts)
+            for index, artifact in enumerate(artifacts):
+                try:
+                    artifact["cef"].update(self._resolve_for_container(artifact["cef"]["playbook"], artifact["container_id"]))
+                except Exception as e:
+                    return action_result.set_status(phantom.APP_ERROR, f"Schedule {index} is invalid. {e}")
+            self._debug("Posting %s artifacts", len(artifacts))
+            response = self._post_rest_data("rest/artifact", artifacts)
+            if not isinstance(response, list):
+                return action_result.set_status(phantom.APP_ERROR, "Artifact creation failed")
+            containers = set()
+            successful = 0
+            for index, (artifact, result) in enumerate(zip(artifacts, response)):
+                success = bool(result.get("success"))
+                action_result.add_data(
+                    {
+                        "index": index,
+                        "artifact_id": result.get("id"),
+                        "container_id": artifact["container_id"],
+                        "playbook": artifact["cef"]["playbook"],
+                        "due_time": artifact["cef"]["dueTime"],
+                        "success": success,
+                        "message": result.get("message"),
+                    }
+                )
+                if success:
+                    successful += 1
+                    containers.add(artifact["container_id"])
+            for container_id in sorted(containers, key=str):
+                self._add_waiting_tag(container_id)
+            action_result.update_summary({"total_objects": len(artifacts), "total_objects_successful": successful})
+            if successful < len(artifacts):
+                return action_result.set_status(phantom.APP_ERROR, f"Created {successful} of {len(artifacts)} schedules")
+            return action_result.set_status(phantom.APP_SUCCESS, f"Successfully created {successful} schedules")
+        except Exception as e:
+            self._progress("Action failed with exception")
+            self._progress("%s", e)
+            return action_result.set_status(phantom.APP_ERROR, e)
+
+    def _iter_fan_out_containers(self, container_ids, container_filter):
+        self._debug("Start")
+        if container_filter:
+            for container in self._iter_rest_data(f"rest/container?{container_filter}", self.page_size):
+                yield container["id"], container
+            return
+        for start in range(0, len(container_ids), self.page_size):
+            chunk = container_ids[start : start + self.page_size]
+            self.container_cache = {}
+            self._prefetch_containers(chunk)
+            for container_id in chunk:
+                yield container_id, self._get_container(container_id)
+
+    def _fan_out_run(self, job):
+        container_id, container, template = job
+        row = {"container_id": container_id, "playbook_run_id": None, "success": False, "message": None}
+        if container is None:
+            row["message"] = "Container could not be retrieved"
+            return row
+        resolution = self._resolve_playbook(template["playbook"], container)
+        if resolution is None:
+            row["message"] = f"Playbook {template['playbook']} does not exist or cannot run on containers labeled {container['label']}"
+            return row
+        try:
+            success, result = self._run_playbook({"container_id": container_id, "cef": dict(template, **resolution)})
+        except Exception as e:
+            row["message"] = str(e)
+            return row
+        row["success"] = success
+        if isinstance(result, dict):
+            row["playbook_run_id"] = result.get("playbook_run_id")
+            row["message"] = result.get("message")
+        elif not success:
+            row["message"] = "Playbook execution failed"
+        return row
+
+    def _fan_out_playbook(self, action_result, playbook, scope, input_data, container_ids, container_filter):
+        self._debug("Start")
+        template = self._build_artifact(None, None, None, playbook, scope, None, input_data)["cef"]
+        rows = []
+        started = time.monotonic()
+        self._start_throttle()
+        try:
+            containers = self._iter_fan_out_containers(container_ids, container_filter)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while True:
+                    page = list(islice(containers, self.page_size))
+                    if not page:
+                        break
+                    rows.extend(executor.map(self._fan_out_run, [(container_id, container, template) for container_id, container in page]))
+                    self._debug("Dispatched playbook runs for %s containers", len(rows))
+        finally:
+            throttle = self._stop_throttle()
+            self.container_cache = None
+        elapsed = time.monotonic() - started
+        successful = 0
+        for row in rows:
+            action_result.add_data(row)
+            successful += row["success"]
+        action_result.update_summary(
+            {
+                "total_objects": len(rows),
+                "total_objects_successful": successful,
+                "elapsed_seconds": round(elapsed, 3),
+                "runs_per_second": round(successful / elapsed, 2) if elapsed else None,
+                "throttle": throttle,
+            }
+        )
+        if not rows:
+            return action_result.set_status(phantom.APP_ERROR, "No containers matched")
+        if successful < len(rows):
+            return action_result.set_status(phantom.APP_ERROR, f"Started {successful} of {len(rows)} playbook runs")
+        return action_result.set_status(phantom.APP_SUCCESS, f"Started {successful} playbook runs")
+
     def _handle_execute_playbook(self, param, action_result):
-        self.__print("Start", True)
+        self._debug("Start")
         try:
-            self.__print("Parsing input fields", True)
+            self._debug("Parsing input fields")
             playbook = param.get("playbook")
-            scope = param.get("playbook_scope")
-            container = None
-            if scope == "artifact":
-                ids = []
-                ids.append(param.get("artifact_id"))
-                scope = ids
-            if "container" in scope:
-                container = param.get("container_id")
-                if "all" in scope:
-                    scope = "all"
-                elif "new" in scope:
-                    scope = "new"
+            scope, container = self._parse_scope(param)
             input_data = self._process_input_data(param)
             if input_data == phantom.APP_ERROR:
                 return phantom.APP_ERROR
-            execution_data = self._create_artifact(None, None, None, playbook, scope, container, input_data)
-            if not self._run_playbook(execution_data):
+            try:
+                container_ids = [int(container_id) for container_id in str(param.get("container_ids") or "").split(",") if container_id.strip()]
+                # Listing a container twice must not run the playbook on it twice
+                container_ids = list(dict.fromkeys(container_ids))
+            except ValueError as e:
+                return action_result.set_status(phantom.APP_ERROR, f"Container ids must be a comma separated list of numbers. Exception: {e}")
+            container_filter = param.get("container_filter")
+            if container_ids or container_filter:
+                if isinstance(scope, list):
+                    return action_result.set_status(
+                        phantom.APP_ERROR, "Artifact scope cannot be combined with container ids or a container filter"
+                    )
+                return self._fan_out_playbook(action_result, playbook, scope, input_data, container_ids, container_filter)
+            resolution = self._resolve_for_container(playbook, container)
+            execution_data = self._create_artifact(None, None, None, playbook, scope, container, input_data, resolution)
+            success, _result = self._run_playbook(execution_data)
+            if not success:
                 return action_result.set_status(phantom.APP_ERROR, "Playbook execution failed")
             return action_result.set_status(phantom.APP_SUCCESS, "Successfully completed execution")
         except Exception as e:
-            self.__print("Action failed with exception")
-            self.__print(e)
+            self._progress("Action failed with exception")
+            self._progress("%s", e)
             return action_result.set_status(phantom.APP_ERROR, e)
 
     def _handle_clear_scheduled_playbooks(self, param, action_result):
-        self.__print("Start", True)
+        self._debug("Start")
         try:
-            self.__print("Removing execution parameters", True)
+            self._debug("Removing execution parameters")
             reason = param.get("cancellation_reason")
             container_identifier = param.get("container_id")
             if container_identifier is None or container_identifier == "":
                 container_identifier = self.get_container_id()
             self._delete_waiting_tag(container_identifier)
-            self._disable_artifact(container_identifier, reason)
+            results = self._disable_artifact(container_identifier, reason)
+            failed = [artifact_id for artifact_id, result in results.items() if not result["success"]]
+            action_result.update_summary({"artifacts_halted": len(results) - len(failed), "artifacts_failed": len(failed)})
+            if failed:
+                return action_result.set_status(phantom.APP_ERROR, f"Failed to halt scheduled playbooks for artifacts {failed}")
             return action_result.set_status(phantom.APP_SUCCESS, "Successfully halted execution")
         except Exception as e:
-            self.__print("Action failed with exception")
-            self.__print(e)
+            self._progress("Action failed with exception")
+            self._progress("%s", e)
             return action_result.set_status(phantom.APP_ERROR, f"Exception: {e}")
 
+    def _delete_artifacts(self, artifact_ids):
+        self._debug("Start")
+        if self._delete_rest_data("rest/artifact", {"ids": artifact_ids}):
+            return artifact_ids, []
+        self._debug("Bulk delete failed, deleting %s artifacts individually", len(artifact_ids))
+        deleted = []
+        failed = []
+        for artifact_id in artifact_ids:
+            if self._delete_rest_data(f"rest/artifact/{artifact_id}"):
+                deleted.append(artifact_id)
+            else:
+                failed.append(artifact_id)
+        return deleted, failed
+
+    def _handle_compact_runner_artifacts(self, param, action_result):
+        self._debug("Start")
+        try:
+            retention_days = param.get("retention_days")
+            retention_days = DEFAULT_RETENTION_DAYS if retention_days in (None, "") else int(retention_days)
+            time_budget = param.get("time_budget")
+            time_budget = DEFAULT_TIME_BUDGET if time_budget in (None, "") else int(time_budget)
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR, f"Retention days and time budget must be numeric. Exception: {e}")
+        if time_budget <= 0:
+            return action_result.set_status(phantom.APP_ERROR, "Time budget must be greater than 0")
+        cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime(ARTIFACT_TIME_FORMAT)
+        uri = (
+            f'rest/artifact?_filter_name__contains="scheduled playbook"&_filter_label__in={json.dumps(list(TERMINAL_LABELS))}'
+            f'&_filter_update_time__lt="{cutoff}"'
+        )
+        started = time.monotonic()
+        archive_path = None
+        archive = None
+        deleted = 0
+        failed = 0
+        complete = False
+        try:
+            if param.get("archive"):
+                archive_path = os.path.join(self.get_state_dir(), f"runner_archive_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.jsonl.gz")
+                archive = gzip.open(archive_path, "wt")
+            artifacts = self._iter_rest_data(uri, self.page_size)
+            while True:
+                if time.monotonic() - started >= time_budget:
+                    self._progress("Time budget of %s seconds reached", time_budget)
+                    break
+                batch = list(islice(artifacts, self.page_size))
+                if not batch:
+                    complete = True
+                    break
+                if archive is not None:
+                    archive.writelines(f"{json.dumps(artifact)}\n" for artifact in batch)
+                    archive.flush()
+                batch_deleted, batch_failed = self._delete_artifacts([artifact["id"] for artifact in batch])
+                deleted += len(batch_deleted)
+                failed += len(batch_failed)
+                self._debug("Deleted %s runner artifacts so far", deleted)
+        except Exception as e:
+            self._progress("Action failed with exception")
+            self._progress("%s", e)
+            return action_result.set_status(phantom.APP_ERROR, f"Compaction failed after deleting {deleted} artifacts. Exception: {e}")
+        finally:
+            if archive is not None:
+                archive.close()
+        action_result.add_data({"deleted": deleted, "failed": failed, "archive_path": archive_path, "complete": complete})
+        action_result.update_summary({"total_objects": deleted + failed, "total_objects_successful": deleted, "complete": complete})
+        if failed:
+            return action_result.set_status(phantom.APP_ERROR, f"Deleted {deleted} runner artifacts, failed to delete {failed}")
+        return action_result.set_status(phantom.APP_SUCCESS, f"Deleted {deleted} runner artifacts older than {retention_days} days")
+
+    def _reserve_execution(self):
+        with self.lock:
+            if self.executions >= self.execution_limit:
+                return False
+            self.executions += 1
+            return True
+
+    def _process_artifacts(self, artifacts):
+        self._debug("Start")
+        for artifact in artifacts:
+            if self.executions >= self.execution_limit:
+                self._debug("Execution limit reached")
+                return
+            self._debug("Processing runner artifact: %s", artifact["id"])
+            self.metrics.increment("scanned")
+            container = self._get_container(artifact["container"])
+            if self._is_expired(artifact):
+                self._debug("Artifact %s is expired", artifact["id"])
+                self.metrics.increment("expired")
+                if self._is_playbook_valid(artifact, container):
+                    self._debug("Playbook is valid")
+                    if not self._reserve_execution():
+                        self._debug("Execution limit reached")
+                        return
+                    if self.claim_owner is not None and not self._mark_dispatched(artifact):
+                        self._progress("Failed to record the dispatch of artifact %s, leaving it to its claim expiry", artifact["id"])
+                        with self.lock:
+                            self.executions -= 1
+                        continue
+                    lateness = datetime.utcnow() - self._get_expiration(artifact)
+                    success, result = self._run_playbook(artifact)
+                    if not success:
+                        self._progress("Failed to run playbook for artifact %s", artifact["id"])
+                    self.metrics.increment("executed")
+                    self.metrics.record_lateness(lateness.total_seconds())
+                    self._update_artifact("complete", artifact, result=result)
+                else:
+                    self._progress("playbook is invalid: %s", artifact["cef"]["playbook"])
+                    self.metrics.increment("invalid")
+                    self._update_artifact("invalid playbook", artifact)
+                with self.lock:
+                    self.touched_containers.add(artifact["container"])
+                    self.processed_ids.add(artifact["id"])
+            else:
+                self._debug("artifact %s is not expired yet", artifact["id"])
+        return
+
+    def _get_schedule_index(self):
+        self._debug("Start")
+        index = self._state.setdefault("schedule_index", {})
+        index.setdefault("heap", [])
+        index.setdefault("watermark", 0)
+        index.setdefault("reconciled", 0)
+        if index.get("shard") != [self.shard_index, self.shard_count]:
+            self._debug("Shard assignment changed, rebuilding the schedule index")
+            index.update({"shard": [self.shard_index, self.shard_count], "reconciled": 0})
+        self.state_keys.add("schedule_index")
+        return index
+
+    def _sync_schedule_index(self, index):
+        self._debug("Start")
+        now = time.time()
+        try:
+            reconcile_interval = int(self.get_config().get("reconcile_interval") or DEFAULT_RECONCILE_INTERVAL) * 60
+        except:
+            reconcile_interval = DEFAULT_RECONCILE_INTERVAL * 60
+        uri = 'rest/artifact?_filter_label="pending"&_filter_name__contains="scheduled playbook"'
+        if now - index["reconciled"] >= reconcile_interval:
+            self._debug("Reconciling schedule index with all pending artifacts")
+            heap = []
+            watermark = 0
+            for artifact in self._iter_rest_data(uri, self.page_size):
+                if self._in_shard(artifact["container"]):
+                    heap.append(self._index_entry(artifact))
+                watermark = artifact["id"]
+            heapq.heapify(heap)
+            index.update({"heap": heap, "watermark": watermark, "reconciled": now})
+            self.metrics.increment("index_reconciled")
+            return
+        added = 0
+        for artifact in self._iter_rest_data(uri, self.page_size, last_id=index["watermark"]):
+            index["watermark"] = artifact["id"]
+            if not self._in_shard(artifact["container"]):
+                continue
+            heapq.heappush(index["heap"], self._index_entry(artifact))
+            added += 1
+        self._debug("Added %s artifacts to the schedule index", added)
+
+    def _priority_key(self, entry):
+        # Highest priority first, then the most overdue. Entries indexed before priorities existed have none.
+        return (-(entry[3] if len(entry) > 3 else 0), entry[0], entry[1])
+
+    def _pop_due_entries(self, index):
+        self._debug("Start")
+        heap = index["heap"]
+        now = time.time()
+        due = {}
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            due[entry[1]] = entry
+        self.index_inflight.update(due)
+        return sorted(due.values(), key=self._priority_key)
+
+    def _iter_indexed_artifacts(self, due):
+        self._debug("Start")
+        for start in range(0, len(due), self.page_size):
+            chunk = {entry[1]: position for position, entry in enumerate(due[start : start + self.page_size])}
+            uri = f'rest/artifact?page_size={len(chunk)}&_filter_label="pending"&_filter_id__in={json.dumps(sorted(chunk))}'
+            artifacts = self._get_rest_data(uri)
+            if artifacts is None:
+                raise Exception("Failed to retrieve due artifacts from the schedule index")
+            found = {artifact["id"] for artifact in artifacts}
+            for artifact_id in set(chunk) - found:
+                self._debug("Artifact %s is no longer pending, skipping it", artifact_id)
+                self.index_inflight.pop(artifact_id, None)
+            now = time.time()
+            for artifact in sorted(artifacts, key=lambda artifact: chunk[artifact["id"]]):
+                if self._get_due_timestamp(artifact) > now:
+                    self._debug("Artifact %s was rescheduled, requeueing it with its new due time", artifact["id"])
+                    self.index_inflight[artifact["id"]] = self._index_entry(artifact)
+                    continue
+                yield artifact
+
+    def _get_due_artifacts(self):
+        self._debug("Start")
+        # Only the index entries are kept to order the due work, the records are read again by id one page at a time
+        now = time.time()
+        due = [entry for entry in map(self._index_entry, self._iter_pending_artifacts(self.page_size)) if entry[0] <= now]
+        due.sort(key=self._priority_key)
+        return due, self._iter_indexed_artifacts(due)
+
+    def _requeue_inflight(self, index):
+        self._debug("Start")
+        for artifact_id, entry in self.index_inflight.items():
+            if artifact_id not in self.processed_ids:
+                heapq.heappush(index["heap"], entry)
+        self.index_inflight = {}
+
+    def _start_throttle(self):
+        self._debug("Start")
+        config = self.get_config()
+        try:
+            min_rate = float(config.get("min_run_rate") or DEFAULT_MIN_RUN_RATE)
+            max_rate = float(config.get("max_run_rate") or DEFAULT_MAX_RUN_RATE)
+        except:
+            self._progress(
+                "Failed to retrieve run rates from config. Defaulting to %s-%s runs per second", DEFAULT_MIN_RUN_RATE, DEFAULT_MAX_RUN_RATE
+            )
+            min_rate, max_rate = DEFAULT_MIN_RUN_RATE, DEFAULT_MAX_RUN_RATE
+        min_rate = max(min_rate, 0.01)
+        max_rate = max(max_rate, min_rate)
+        learned = self._state.get("throttle", {})
+        self.throttle = AdaptiveThrottle(min_rate, max_rate, self.max_workers, learned.get("rate"), learned.get("concurrency"))
+
+    def _stop_throttle(self):
+        self._debug("Start")
+        summary = self.throttle.summary()
+        self._state["throttle"] = {"rate": self.throttle.rate, "concurrency": self.throttle.concurrency}
+        self.state_keys.add("throttle")
+        self.throttle = None
+        return summary
+
+    def _in_shard(self, container_id):
+        return self.shard_count == 1 or int(container_id) % self.shard_count == self.shard_index
+
+    def _claim_artifacts(self, artifacts):
+        self._debug("Start")
+        # The REST API has no conditional update, but it rejects a second artifact with the same source data identifier
+        # in a container. Creating one marker artifact per schedule is therefore a lock only one runner asset can take.
+        if not artifacts:
+            return []
+        expires = int(time.time()) + self.claim_ttl
+        markers = [
+            {
+                "container_id": artifact["container"],
+                "name": "runner claim",
+                "label": "claim",
+                "source_data_identifier": f"runner-claim-{artifact['id']}",
+                "cef": {"artifactId": artifact["id"], "claimOwner": self.claim_owner, "claimExpires": expires},
+                "run_automation": False,
+            }
+            for artifact in artifacts
+        ]
+        response = self._post_rest_data("rest/artifact", markers)
+        if not isinstance(response, list):
+            raise Exception("Failed to create claim markers")
+        locked = {artifact["id"]: result["id"] for artifact, result in zip(artifacts, response) if result.get("success")}
+        # Re-read under the lock so schedules another asset finished after our listing are not run twice
+        uri = f'rest/artifact?page_size={max(len(locked), 1)}&_filter_label="pending"&_filter_id__in={json.dumps(sorted(locked))}'
+        current = self._get_rest_data(uri) if locked else []
+        if current is None:
+            self._delete_artifacts(list(locked.values()))
+            raise Exception("Failed to read back claimed artifacts")
+        claims = []
+        for artifact in current:
+            artifact["cef"] = dict(artifact["cef"], claimOwner=self.claim_owner, claimExpires=expires)
+            claims.append((artifact["id"], {"label": "claimed", "cef": artifact["cef"]}))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = dict(executor.map(self._post_artifact_update, claims))
+        owned = {artifact["id"]: artifact for artifact in current if results[artifact["id"]]["success"]}
+        unused = [marker_id for artifact_id, marker_id in locked.items() if artifact_id not in owned]
+        if unused:
+            self._delete_artifacts(unused)
+        with self.lock:
+            self.claim_markers.update({artifact_id: locked[artifact_id] for artifact_id in owned})
+            # Claimed elsewhere or already finished, either way not ours to requeue
+            self.processed_ids.update(artifact["id"] for artifact in artifacts if artifact["id"] not in locked or artifact["id"] not in results)
+        lost = len(artifacts) - len(locked)
+        if lost:
+            self._debug("%s artifacts are claimed by another runner asset", lost)
+        self.metrics.increment("claimed", len(owned))
+        self.metrics.increment("claims_lost", lost)
+        return [owned[artifact["id"]] for artifact in artifacts if artifact["id"] in owned]
+
+    def _mark_dispatched(self, artifact):
+        self._debug("Start")
+        # Recorded on the marker before the run, so a claim that expires before the final label is written finishes
+        # the schedule instead of making it pending again and running the playbook a second time
+        cef = {
+            "artifactId": artifact["id"],
+            "claimOwner": self.claim_owner,
+            "claimExpires": artifact["cef"].get("claimExpires"),
+            "dispatched": True,
+        }
+        return self._post_rest_data(f"rest/artifact/{self.claim_markers[artifact['id']]}", {"cef": cef}) is not None
+
+    def _release_claim_markers(self):
+        self._debug("Start")
+        # Only unlock schedules whose final label was written, anything else is released once its claim expires
+        done = [
+            marker_id
+            for artifact_id, marker_id in self.claim_markers.items()
+            if self.artifact_update_results.get(artifact_id, {}).get("success")
+        ]
+        if done:
+            self._delete_artifacts(done)
+        self.claim_markers = {}
+
+    def _release_stale_claims(self, index):
+        self._debug("Start")
+        uri = f'rest/artifact?_filter_name="runner claim"&_filter_cef__claimExpires__lt={int(time.time())}'
+        markers = (marker for marker in self._iter_rest_data(uri, self.page_size) if self._in_shard(marker["container"]))
+        released = 0
+        finished = 0
+        while True:
+            batch = {marker["cef"]["artifactId"]: marker for marker in islice(markers, self.page_size)}
+            if not batch:
+                break
+            artifacts = self._get_rest_data(f"rest/artifact?page_size={len(batch)}&_filter_id__in={json.dumps(sorted(batch))}")
+            if artifacts is None:
+                raise Exception("Failed to retrieve artifacts with expired claims")
+            for artifact in artifacts:
+                if artifact["label"] not in ("pending", "claimed"):
+                    continue
+                owner = batch[artifact["id"]]["cef"].get("claimOwner")
+                cef = {key: value for key, value in artifact["cef"].items() if key not in CLAIM_FIELDS}
+                if batch[artifact["id"]]["cef"].get("dispatched"):
+                    self._debug("Artifact %s was run by %s before its claim expired, completing it", artifact["id"], owner)
+                    cef["exeComment"] = f"Execution run by {owner} before its claim expired"
+                    self._queue_artifact_update(artifact["id"], {"label": "complete", "cef": cef})
+                    self.touched_containers.add(artifact["container"])
+                    finished += 1
+                    continue
+                self._debug("Claim on artifact %s by %s expired", artifact["id"], owner)
+                if artifact["label"] == "claimed":
+                    self._queue_artifact_update(artifact["id"], {"label": "pending", "cef": cef})
+                if index is not None:
+                    heapq.heappush(index["heap"], self._index_entry(artifact))
+                released += 1
+            self._flush_artifact_updates()
+            results = self.artifact_update_results
+            self._delete_artifacts(
+                [marker["id"] for artifact_id, marker in batch.items() if results.get(artifact_id, {"success": True})["success"]]
+            )
+        self.metrics.increment("claims_released", released)
+        self.metrics.increment("claims_finished", finished)
+        return released + finished
+
+    def _coalesce_page(self, page):
+        self._debug("Start")
+        runs = []
+        for artifact in page:
+            if not self._is_expired(artifact):
+                runs.append(artifact)
+                continue
+            key = self._coalesce_key(artifact["container"], artifact["cef"])
+            if key not in self.coalesce_keys:
+                self.coalesce_keys.add(key)
+                runs.append(artifact)
+                continue
+            self._debug("Artifact %s duplicates a schedule already run in this poll", artifact["id"])
+            self.metrics.increment("coalesced")
+            self._update_artifact("coalesced", artifact)
+            with self.lock:
+                self.touched_containers.add(artifact["container"])
+                self.processed_ids.add(artifact["id"])
+        return runs
+
+    def _process_page(self, page):
+        self._debug("Start")
+        if self.claim_owner is not None:
+            due = [artifact for artifact in page if self._is_expired(artifact)]
+            page = self._claim_artifacts(due[: max(self.execution_limit - self.executions, 0)])
+        if self.coalesce:
+            page = self._coalesce_page(page)
+        containers = {}
+        for artifact in page:
+            containers.setdefault(artifact["container"], []).append(artifact)
+        self._prefetch_containers(containers)
+        if self.max_workers == 1:
+            self._process_artifacts(page)
+            return
+        self._debug("Dispatching %s containers over %s workers", len(containers), self.max_workers)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._process_artifacts, artifacts) for artifacts in containers.values()]
+            for future in futures:
+                future.result()
+        self._flush_artifact_updates()
+
     def _handle_on_poll(self, param, action_result):
-        self.__print("Start", True)
+        self._debug("Start")
         self.is_polling_action = True
         try:
             limit = int(self.get_config().get("playbook_limit"))
-            self.__print(f"Execution limit set to {limit}")
+            self._progress("Execution limit set to %s", limit)
         except:
             limit = 4
-            self.__print("Failed to retrieve execution limit from config. Defaulting to 4")
+            self._progress("Failed to retrieve execution limit from config. Defaulting to 4")
+        self.container_cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.executions = 0
+        self.execution_limit = limit
+        self.artifact_updates = []
+        self.artifact_update_results = {}
+        self.touched_containers = set()
+        self.processed_ids = set()
+        self.index_inflight = {}
+        self.coalesce_keys = set()
+        index = None
+        claims_released = None
+        if self.shard_count > 1:
+            self.claim_owner = f"{self.get_asset_id()}:{self.shard_index}:{uuid.uuid4().hex}"
+            self.claim_markers = {}
+            self._progress("Polling shard %s of %s", self.shard_index, self.shard_count)
+        self._start_throttle()
         try:
-            executions = 0
-            for artifact in self._get_all_pending_artifacts():
-                self.__print(f"Processing runner artifact: {artifact['id']}", True)
-                container = self._get_container(artifact)
-                if self._is_expired(artifact):
-                    self.__print(f"Artifact {artifact['id']} is expired", True)
-                    if self._is_playbook_valid(artifact, container):
-                        self.__print("Playbook is valid", True)
-                        executions += 1
-                        result = self._run_playbook(artifact)
-                        self._update_artifact("complete", artifact, result=result)
-                    else:
-                        self.__print(f"playbook is invalid: {artifact['cef']['playbook']}")
-                        self._update_artifact("invalid playbook", artifact)
-                    if self._is_playbook_pending(artifact):
-                        self.__print("playbooks pending", True)
-                    else:
-                        self.__print("no playbooks pending", True)
-                        self._delete_tag("waiting", artifact)
-                else:
-                    self.__print(f"artifact {artifact['id']} is not expired yet", True)
-                if executions > limit:
+            if self.get_config().get("schedule_index", True):
+                index = self._get_schedule_index()
+                self._sync_schedule_index(index)
+            if self.claim_owner is not None:
+                claims_released = self._release_stale_claims(index)
+            if index is not None:
+                if not index["heap"] or index["heap"][0][0] > time.time():
+                    self._progress("No scheduled playbooks are due")
+                    action_result.update_summary({"playbooks_executed": 0, "indexed_schedules": len(index["heap"]), "backlog_depth": 0})
+                    return action_result.set_status(phantom.APP_SUCCESS, "0 playbooks executed")
+                due = self._pop_due_entries(index)
+                pending_artifacts = self._iter_indexed_artifacts(due)
+            else:
+                due, pending_artifacts = self._get_due_artifacts()
+            backlog_depth = len(due)
+            max_lateness = round(time.time() - min(entry[0] for entry in due), 3) if due else 0
+            self._progress("%s scheduled playbooks are due, the most overdue by %s seconds", backlog_depth, max_lateness)
+            while self.executions < limit:
+                # Never fetch more than the remaining budget so parallel workers cannot run lower priority work first
+                page = list(islice(pending_artifacts, min(self.page_size, limit - self.executions)))
+                if not page:
                     break
-            self.__print(f"{executions} playbooks executed")
+                self._debug("Processing page of %s pending artifacts", len(page))
+                self._process_page(page)
+            if index is not None:
+                self._requeue_inflight(index)
+            self._flush_artifact_updates()
+            if self.claim_markers:
+                self._release_claim_markers()
+            tags_removed = self._reconcile_waiting_tags(self.touched_containers)
+            executions = self.executions
+            update_failures = Counter(result["label"] for result in self.artifact_update_results.values() if not result["success"])
+            self._progress("%s playbooks executed", executions)
+            action_result.update_summary(
+                {
+                    "playbooks_executed": executions,
+                    "container_cache_hits": self.cache_hits,
+                    "container_cache_misses": self.cache_misses,
+                    "artifact_updates": len(self.artifact_update_results),
+                    "artifact_update_failures": dict(update_failures),
+                    "waiting_tags_removed": tags_removed,
+                    "indexed_schedules": len(index["heap"]) if index is not None else None,
+                    "stale_claims_released": claims_released,
+                    "backlog_depth": backlog_depth,
+                    "max_lateness_seconds": max_lateness,
+                }
+            )
             return action_result.set_status(phantom.APP_SUCCESS, f"{executions} playbooks executed")
         except Exception as e:
-            self.__print("Error processing artifacts and playbooks")
-            self.__print(e)
+            self._progress("Error processing artifacts and playbooks")
+            self._progress("%s", e)
+            self._flush_artifact_updates()
+            if self.claim_markers:
+                self._release_claim_markers()
             return self.set_status(phantom.APP_ERROR, "Error processing artifacts and playbooks")
+        finally:
+            self.artifact_updates = None
+            if index is not None:
+                self._requeue_inflight(index)
+            action_result.update_summary({"throttle": self._stop_throttle()})
 
     def initialize(self):
         config = self.get_config()
+        self._state = self.load_state() or {}
         try:
             self.print_debug = config.get("debug")
         except Exception as e:
-            self.__print(f"Exception occurred while getting debug key. Exception: {e}")
-            self.__print("Defaulting to debug = False")
+            self._progress("Exception occurred while getting debug key. Exception: %s", e)
+            self._progress("Defaulting to debug = False")
             self.print_debug = False
         try:
-            token = config.get("cluster_api_token")
-            self.headers = {"ph-auth-token": token}
-            self.__print("API token provided. Using token authed session")
+            self.max_workers = max(int(config.get("max_workers") or 1), 1)
         except:
-            self.__print("No API token provided. Using inherited session from phantom.requests")
-            self.headers = {}
-        if self.headers:
-            self.session = requests.Session()
-            self.session.headers = self.headers
+            self._progress("Failed to retrieve max workers from config. Defaulting to 1")
+            self.max_workers = 1
+        try:
+            self.page_size = max(int(config.get("page_size") or DEFAULT_PAGE_SIZE), 1)
+        except:
+            self._progress("Failed to retrieve page size from config. Defaulting to %s", DEFAULT_PAGE_SIZE)
+            self.page_size = DEFAULT_PAGE_SIZE
+        try:
+            self.shard_count = max(int(config.get("shard_count") or 1), 1)
+            self.shard_index = int(config.get("shard_index") or 0)
+            self.claim_ttl = max(int(config.get("claim_ttl") or DEFAULT_CLAIM_TTL), 1) * 60
+        except Exception as e:
+            return self.set_status(phantom.APP_ERROR, f"Shard count, shard index and claim TTL must be numeric. Exception: {e}")
+        if not 0 <= self.shard_index < self.shard_count:
+            return self.set_status(phantom.APP_ERROR, f"Shard index must be between 0 and {self.shard_count - 1}")
+        self.coalesce = bool(config.get("coalesce", False))
+        token = config.get("cluster_api_token")
+        self.headers = {"ph-auth-token": token} if token else {}
+        self.session = self._build_session()
         return phantom.APP_SUCCESS
 
     def handle_action(self, param):
-        self.__print("Start", True)
+        self._debug("Start")
         ret_val = phantom.APP_SUCCESS
+        self.metrics = RunnerMetrics()
 
         action_id = self.get_action_identifier()
-        self.__print(f"action_id: {self.get_action_identifier()}")
+        self._debug("action_id: %s", self.get_action_identifier())
 
         action_result = self.add_action_result(ActionResult(dict(param)))
 
         if action_id == "schedule_playbook":
             ret_val = self._handle_schedule_playbook(param, action_result)
 
+        if action_id == "schedule_playbooks":
+            ret_val = self._handle_schedule_playbooks(param, action_result)
+
         if action_id == "execute_playbook":
             ret_val = self._handle_execute_playbook(param, action_result)
 
@@ -537,10 +1854,25 @@ class RunnerConnector(phantom.BaseConnector):
         if action_id == "count_runner_artifacts":
             ret_val = self._handle_count_runner_artifacts(param, action_result)
 
+        if action_id == "compact_runner_artifacts":
+            ret_val = self._handle_compact_runner_artifacts(param, action_result)
+
         if action_id == "on_poll":
             ret_val = self._handle_on_poll(param, action_result)
 
         if action_id == "test_connectivity":
             ret_val = self._handle_test_connectivity(param, action_result)
 
+        metrics = self.metrics.summary()
+        action_result.update_summary({"metrics": metrics})
+        self._write_metrics(action_id, metrics)
         return ret_val
+
+    def finalize(self):
+        if self.state_keys:
+            # Reload before saving so concurrent actions on the same asset only overwrite the keys they changed
+            state = self.load_state() or {}
+            for key in self.state_keys:
+                state[key] = self._state[key]
+            self.save_state(state)
+        return phantom.APP_SUCCESS